@@ -0,0 +1,185 @@
+"""
+Compares Rubric.load_md with the parser it replaced, on a synthetic
+cohort of marks files. Run from the repo root:
+
+    python -m benchmarks.bench_load_md [--students N] [--criteria PATH]
+"""
+
+import argparse
+import contextlib
+import os
+import random
+import time
+from typing import Callable, List
+
+from csse3010_tools.rubric import Band, Rubric, RubricTemplate
+
+
+# The original implementation, kept verbatim for comparison.
+def legacy_load_md(self: Rubric, md: str):
+    lines = md.strip().split("\n")
+    if not lines:
+        self.clear_marks()
+        return  # Nothing to parse
+
+    # 1) Find the header line that starts with '| cid'
+    header_idx = None
+    for i, line in enumerate(lines):
+        if line.strip().lower().startswith("| cid"):
+            header_idx = i
+            break
+
+    if header_idx is None:
+        # No recognizable header found, nothing to load
+        self.clear_marks()
+        return
+
+    # 2) Parse the header line to get the column names
+    header_line = lines[header_idx].strip()
+    header_cells = [c.strip() for c in header_line.split("|") if c.strip()]
+    # Example: header_cells might look like ['cid', 'dt1', 'dt2', 'mylib']
+
+    # The first cell should be 'cid', and the rest are the task descriptions
+    if not header_cells or header_cells[0].lower() != "cid":
+        self.clear_marks()
+        return
+    task_names = header_cells[1:]  # everything after 'cid'
+
+    # 3) Create a map from task name -> Task object (for quick lookup)
+    task_map = {}
+    for k, t in self.tasks.items():
+        task_map[k] = t
+
+    # 4) Skip the alignment line (the next line after the header)
+    data_start_idx = header_idx + 2
+
+    # 5) Process the data rows
+    for row_idx in range(data_start_idx, len(lines)):
+        line = lines[row_idx].strip()
+        if not line.startswith("|"):
+            # No longer in table rows
+            break
+
+        # Split by '|' and strip
+        print("ROW CELLS HERE NERD:")
+        print(line)
+        row_cells = [c.strip() for c in line.split("|")]
+        print(row_cells)
+        row_cells = row_cells[1 : (len(row_cells) - 1)]
+        print(row_cells)
+
+        # If there are not enough cells, skip
+        if len(row_cells) < 2:
+            continue
+
+        # The first cell is either 'avg.' or something like 'a.', 'b.', etc.
+        cid_cell = row_cells[0].lower()
+        if cid_cell.startswith("avg"):
+            # This is the 'avg.' row. We ignore it.
+            continue
+
+        # The first cell may also be comment
+        comment_cell = row_cells[0].lower()
+
+        # Otherwise, parse out the band key. Usually it's 'a.', 'b.', etc.
+        band_key = cid_cell.rstrip(".")
+
+        # We expect the subsequent cells to match up with the task_names
+        # e.g. row_cells[1] => task_names[0], row_cells[2] => task_names[1], ...
+        for col_idx, cell_val in enumerate(row_cells[1:]):
+            if col_idx >= len(task_names):
+                break  # More columns than we have tasks, oops
+
+            task_name = task_names[col_idx]
+            # Find the corresponding Task object
+            task_obj = task_map.get(task_name)
+            if not task_obj:
+                # The Markdown had a column for a task name we don't have;
+                # skip it or optionally create it. We'll skip here.
+                continue
+
+            if comment_cell.startswith("comment"):
+                print(task_names)
+                print(task_obj)
+                print(cell_val)
+                task_obj.comment = cell_val
+                continue
+
+            # If the cell is '-', skip updating
+            if cell_val == "-":
+                continue
+
+            # Attempt to parse the cell as a float
+            try:
+                chosen_val = int(cell_val)
+            except ValueError:
+                # If it fails, skip (or default to 0)
+                continue
+
+            # Ensure the band exists in this task
+            if band_key not in task_obj.bands:
+                task_obj.bands[band_key] = Band()
+
+            # Update the chosen mark
+            task_obj.bands[band_key].choice = chosen_val
+
+
+def synthetic_cohort(template: RubricTemplate, students: int) -> List[str]:
+    """
+    Marks files for a cohort with random choices and comments.
+    """
+    rng = random.Random(3010)
+    files = []
+    for i in range(students):
+        marks = template.new_marks()
+        marks.choices = [rng.randint(0, 5) for _ in marks.choices]
+        marks.comments = [f"comment {i} task {j}" for j in range(len(marks.comments))]
+        files.append(template.instantiate(marks).into_md())
+    return files
+
+
+def bench(
+    files: List[str],
+    load: Callable[[Rubric, str], object],
+    template: RubricTemplate,
+) -> float:
+    rubrics = [template.instantiate() for _ in files]
+    start = time.perf_counter()
+    for rubric, md in zip(rubrics, files):
+        load(rubric, md)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--criteria", default=os.path.join("criteria", "2025-s1.yaml"))
+    args = parser.parse_args()
+
+    template = RubricTemplate.from_file(args.criteria)
+    files = synthetic_cohort(template, args.students)
+    print(f"{len(files)} marks files, {len(template.slots)} bands each")
+
+    # The legacy parser prints several lines per row, which is part of its cost
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        timings = {
+            "legacy": bench(files, legacy_load_md, template),
+            "load_md": bench(files, Rubric.load_md, template),
+            "parse_md": bench(files, lambda _, md: template.parse_md(md), template),
+        }
+    for name, elapsed in timings.items():
+        speedup = timings["legacy"] / elapsed
+        print(f"{name:>8}: {elapsed * 1000:8.1f} ms ({speedup:.1f}x)")
+
+    # Both parsers must agree
+    for md in files[:50]:
+        old, new = template.instantiate(), template.instantiate()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            legacy_load_md(old, md)
+        new.load_md(md)
+        assert old.into_md() == new.into_md()
+        assert template.marks_of(new) == template.parse_md(md)[0]
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,73 @@
-import shutil
 import os
 import json
-import re
-from dataclasses import dataclass
-from typing import Dict, List, Optional
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+from csse3010_tools.build import (
+    BuildKey,
+    BuildResult,
+    build_stage,
+    get_or_build,
+    load_result,
+    make_key,
+    normalize_stage_dir,
+)
+from csse3010_tools.commitcache import (
+    CommitInfo,
+    commits_from_store,
+    commits_since,
+    load_commits,
+    save_commits,
+)
+from csse3010_tools.criteria import CriteriaIndex
+from csse3010_tools.giteaclient import GITEA_URL, client_stats, get_client, read_token
+from csse3010_tools.hashes import NO_COMMITS
+from csse3010_tools.marksindex import MarksIndex
+from csse3010_tools.marksmerge import blob_hash, merge_marks, merge_marks_md
+from csse3010_tools.markssync import MarksSync, SyncResult
+from csse3010_tools.markswriter import MarksWriter
+from csse3010_tools.prefetch import Prefetcher
+from csse3010_tools.repostore import RepoStore
+from csse3010_tools.roster import (
+    Roster,
+    Student,
+    fetch_roster,
+    load_roster,
+    save_roster,
+)
+from csse3010_tools.startup import STARTUP
+
+# git, gitea and the rubric parser (serde) are slow to import, so they are
+# imported on first use rather than before the first frame is drawn
+if TYPE_CHECKING:
+    from gitea import Gitea
+    from textual.app import App
+
+    from csse3010_tools.rubric import Rubric, RubricTemplate
 
-from git import Repo
-import git
-from gitea import Gitea, User, Organization, Repository, Commit
-from serde.yaml import from_yaml
-from textual.app import App
 
-from csse3010_tools.rubric import Rubric
-
-TOKEN_PATH = ".access_token"
-GITEA_URL = "https://csse3010-gitea.uqcloud.net"
-
-
-def _list_files(directory: str) -> List[str]:
+@dataclass
+class WarmUpProgress:
     """
-    Recursively list all files in the given directory.
+    Reported by AppState.warm_up as each phase makes progress.
+    phase is one of "criteria", "students" or "gitea".
     """
-    file_paths = []
-    for root, _, files in os.walk(directory):
-        for file in files:
-            file_paths.append(os.path.join(root, file))
-    return file_paths
 
+    phase: str
+    done: int
+    total: int
+    message: str = ""
+    # For "students", the students resolved since the last report
+    students: List[Student] = field(default_factory=list)
 
-@dataclass
-class CommitInfo:
-    date: str
-    hash: str
-    message: str
-    url: str
+    @property
+    def finished(self) -> bool:
+        return self.done >= self.total
 
 
 class AppState:
-    def __init__(self, app: App):
+    def __init__(self, app: "App"):
         # Internal "state" fields
         self._year: Optional[str] = None
         self._semester: Optional[str] = None
@@ -45,21 +75,54 @@ class AppState:
         self._student_number: Optional[str] = None
         self._commit_hash: Optional[str] = None
         self._rubric: Optional[Rubric] = None
-        self._app: App = app
-
-        # Gitea client
-        self._gitea = self._init_gitea()
+        self._template: Optional[RubricTemplate] = None
+        # The current student and stage's marks.md, looked up once per rubric
+        # rather than on every edit
+        self._rubric_path: Optional[str] = None
+        self._app: "App" = app
+
+        # Shared object store + per student worktrees, the next few
+        # students are checked out in the background by the prefetcher
+        self._repo_store = RepoStore()
+        self._prefetcher = Prefetcher(self._repo_store)
+
+        # The shared Gitea client, created on first use
+        with STARTUP.phase("token"):
+            self._token = read_token()
+
+        # Marks are saved in the background, a short while after the last edit
+        self._marks_writer = MarksWriter(on_error=self._on_marks_write_error)
+
+        # Blob hash and content of each marks.md as we last read or wrote it.
+        # Anything else found on disk came from another marker (through a
+        # sync) and is merged into the rubric rather than overwritten.
+        self._marks_base: Dict[str, Tuple[str, str]] = {}
+        self._marks_merged_callback: Optional[Callable[[], None]] = None
+        # Called on the UI thread once a checkout that had to fetch is done
+        self._checked_out_callback: Optional[Callable[[], None]] = None
+
+        # Layout of the marks repo, built once it has been cloned,
+        # and batched commits and pushes of it
+        self._marks_index: Optional[MarksIndex] = None
+        self._marks_sync: Optional[MarksSync] = None
 
         # In-memory caches
-        self._students: Dict[str, User] = {}
-        self._criteria_list: List[Rubric] = []
+        self._students: Dict[str, Student] = {}
+        self._criteria = CriteriaIndex()
         self._commits_cache: Dict[str, List[CommitInfo]] = {}
 
+        # Filled in by warm_up()
+        self.gitea_version: Optional[str] = None
+        self.gitea_user: Optional[str] = None
+
         self._latest_commits = self._load_latest_commits()
 
-        # Initial loading
-        self._load_students()
-        self._load_criteria()
+        # Initial loading, only from local disk. Everything that needs the
+        # network (or parsing every rubric) happens later in warm_up().
+        with STARTUP.phase("roster cache"):
+            self._roster: Optional[Roster] = load_roster()
+        if self._roster:
+            self._students = self._roster.students
 
     @property
     def year(self) -> Optional[str]:
@@ -102,7 +165,8 @@ class AppState:
     def student_number(self, value: str):
         if value != self._student_number:
             self._student_number = value
-            self._commit_hash = None  # Clear the commit hash to avoid confusion
+            # Go straight to the marked commit (if known) so we only check out once
+            self._commit_hash = self._marked_commit(value)
             self._clone_student_repo()
             self._reload_rubric()
 
@@ -117,12 +181,14 @@ class AppState:
             self._clone_student_repo()
 
     @property
-    def rubric(self) -> Optional[Rubric]:
+    def rubric(self) -> Optional["Rubric"]:
         """Returns the currently loaded rubric, if any"""
         return self._rubric
 
     @rubric.setter
-    def rubric(self, value: Rubric):
+    def rubric(self, value: "Rubric"):
+        if self._rubric is not None and self._rubric is not value:
+            self._rubric.on_change(None)
         self._rubric = value
         self._rubric.on_change(self._write_marks)
         self._write_marks()
@@ -131,19 +197,19 @@ class AppState:
         """
         Returns the distinct semesters across all loaded criteria.
         """
-        return sorted(list({crit.sem for crit in self._criteria_list}))
+        return self._criteria.semesters()
 
     def get_years(self) -> List[str]:
         """
         Returns the distinct years across all loaded criteria.
         """
-        return sorted(list({crit.year for crit in self._criteria_list}))
+        return self._criteria.years()
 
     def get_stages(self) -> List[str]:
         """
         Returns the distinct stage names (like S1, PF, etc.) across all loaded criteria.
         """
-        return sorted(list({crit.name for crit in self._criteria_list}))
+        return self._criteria.stages()
 
     def list_student_numbers(self) -> List[str]:
         """
@@ -151,53 +217,65 @@ class AppState:
         """
         return list(self._students.keys())
 
+    def add_students(self, students: List[Student]) -> None:
+        """
+        Adds students resolved while the roster is still being fetched, so
+        they can be picked straight away. Call from the UI thread.
+        """
+        for student in students:
+            self._students[student.username] = student
+
     def get_student_name(self, student_number: str) -> Optional[str]:
         """
         Returns the full name for the given student number, if known.
         """
-        user = self._students.get(student_number)
-        return user.full_name if user else None
+        student = self._students.get(student_number)
+        return student.full_name if student else None
 
-    def get_criteria(self, year: str, semester: str, task: str) -> Rubric:
+    def get_criteria(self, year: str, semester: str, task: str) -> "RubricTemplate":
         """
-        Searches loaded rubrics for one matching the given year, semester, and task (stage).
-        Raises FileNotFoundError if no matching rubric is found.
+        Returns the compiled rubric matching the given year, semester, and task (stage),
+        parsing it on first use. Raises FileNotFoundError if there is none.
         """
-        for crit in self._criteria_list:
-            if crit.year == year and crit.sem == semester and crit.name == task:
-                return crit
-        raise FileNotFoundError(
-            f"No matching criteria found for {year=}, {semester=}, {task=}"
-        )
+        return self._criteria.get(year, semester, task)
 
     def list_commits(self, student_number: str) -> List[CommitInfo]:
         """
-        Returns a list of the commits from the student's 'repo' repository,
-        caching results to avoid repeated API calls.
+        Returns the commits from the student's 'repo' repository as last
+        cached (in memory or on disk), without touching the network.
+        Call refresh_commits to bring them up to date.
         """
         if student_number not in self._commits_cache:
-            student = self._students.get(student_number)
-            if not student:
-                return []
-
-            repo = self._get_student_repo(student)
-            if not repo:
-                return []
-
-            commits = []
-            for c in repo.get_commits():
-                commits.append(
-                    CommitInfo(
-                        date=c.created,
-                        hash=c.sha,
-                        message=c._commit["message"],
-                        url=c._html_url,
-                    )
-                )
-            self._commits_cache[student_number] = commits
-
+            self._commits_cache[student_number] = load_commits(student_number) or []
         return self._commits_cache[student_number]
 
+    def refresh_commits(self, student_number: str) -> List[CommitInfo]:
+        """
+        Brings the student's cached commits up to date: first from the repo
+        store if they are in it, then with only the commits the API has that
+        we don't. Blocks, so run it from a background worker.
+        """
+        student = self._students.get(student_number)
+        if not student or not student.has_repo:
+            return self.list_commits(student_number)
+
+        commits = self.list_commits(student_number)
+        try:
+            local = commits_from_store(self._repo_store, student, GITEA_URL)
+            if local:
+                commits = local
+        except Exception as e:
+            print(f"Could not list {student_number}'s commits from the store: {e}")
+        try:
+            commits = commits_since(self._gitea, student, commits)
+        except Exception as e:
+            print(f"Could not fetch {student_number}'s commits: {e}")
+
+        if commits != self._commits_cache.get(student_number):
+            self._commits_cache[student_number] = commits
+            save_commits(student_number, commits)
+        return commits
+
     def _read_marks(self) -> str:
         """
         Reads the marks for the given student_number and stage from the
@@ -206,38 +284,38 @@ class AppState:
         if not self._student_number or not self._stage:
             return
 
-        marks_dir = self._marks_directory
-        stage_dir = self._normalize_stage_dir(self._stage)
-        student_id = self._student_number[1:]  # e.g. strip 's' from 's1234567'
+        # Don't read back an older version of marks that are still being saved
+        self._marks_writer.flush()
 
-        for i in range(10):
-            path = os.path.join(marks_dir, f"{student_id}{i}", stage_dir, "marks.md")
-            if os.path.exists(path):
-                with open(path, "r") as f:
-                    return f.read()
-        return ""
+        path = self._rubric_path
+        if not path:
+            return ""
+        content = self._read_marks_file(path) or ""
+        self._marks_base[path] = (blob_hash(content), content)
+        return content
+
+    def _read_marks_file(self, path: str) -> Optional[str]:
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return f.read()
 
     def _write_marks(self) -> None:
         """
-        Writes the given Rubric object as markdown to the marks.md file
-        for the specified student_number and stage.
+        Queues the current Rubric to be written as markdown to the marks.md
+        file for the specified student_number and stage. The markdown is
+        rendered and saved by the marks writer once edits settle down.
         """
         if not self._stage or not self._student_number or not self._rubric:
             return
 
-        marks_dir = self._marks_directory
-        stage_dir = self._normalize_stage_dir(self._stage)
-        md_content = Rubric.into_md(self._rubric)
-        student_id = self._student_number[1:]  # e.g. strip 's' from 's1234567'
-
-        for i in range(10):
-            path = os.path.join(marks_dir, f"{student_id}{i}", stage_dir)
-            if os.path.exists(path):
-                path = os.path.join(path, "marks.md")
-                with open(path, "w") as f:
-                    f.write(md_content)
-                    print(f"Wrote marks to {path}")
-                return  # Once we find and write, we're done.
+        path = self._rubric_path
+        if path:
+            rubric, template = self._rubric, self._template
+            self._marks_writer.schedule(
+                path, lambda: self._render_marks(path, rubric, template)
+            )
+            return
 
         print(f"Failed to write marks for {self._student_number}")
         self._app.notify(
@@ -245,13 +323,159 @@ class AppState:
             severity="error",
         )
 
-    def _init_gitea(self) -> Gitea:
+    def _marks_path(self) -> Optional[str]:
+        """
+        Returns the marks.md path for the current student and stage from the
+        marks repo index, or None if their stage directory doesn't exist.
+        """
+        if not self._marks_index or not self._student_number or not self._stage:
+            return None
+        stage_dir = self._normalize_stage_dir(self._stage)
+        return self._marks_index.marks_path(self._student_number, stage_dir)
+
+    def _render_marks(
+        self, path: str, rubric: "Rubric", template: Optional["RubricTemplate"]
+    ) -> str:
+        """
+        Renders the marks to be saved to path, on the marks writer's thread.
+        If path has changed on disk since we last read or wrote it, the
+        other marker's changes are merged in rather than overwritten, and
+        merge_marks_from_disk is queued on the UI thread to bring them into
+        the rubric. Edits themselves never touch the disk on the UI thread.
+        """
+        ours = rubric.into_md()
+        diverged = self._diverged_marks(path)
+        if diverged is None or template is None:
+            self._marks_base[path] = (blob_hash(ours), ours)
+            return ours
+        base, theirs = diverged
+        merged, _ = merge_marks_md(template, base, ours, theirs)
+        self._app.call_later(self.merge_marks_from_disk)
+        return merged
+
+    def _diverged_marks(self, path: str) -> Optional[Tuple[str, str]]:
+        """
+        Returns (what we last read or wrote, what's there now) if path has
+        been changed on disk by someone else, otherwise None.
+        """
+        base = self._marks_base.get(path)
+        theirs = self._read_marks_file(path) if base else None
+        if theirs is None or blob_hash(theirs) == base[0]:
+            return None
+        return base[1], theirs
+
+    def merge_marks_from_disk(self) -> bool:
+        """
+        Merges changes someone else made to the current student's marks.md
+        since we read it (brought in by a sync) into the rubric, band by band
+        and comment by comment. Where both changed the same band or comment
+        ours is kept. Returns whether anything was merged.
+
+        Runs on the UI thread after a sync, or when the marks writer finds
+        the file changed underneath it, not on every edit.
+        """
+        path = self._rubric_path
+        if not path or not self._rubric or not self._template:
+            return False
+        if self._diverged_marks(path) is None:
+            return False
+        # The change may be our own write still landing
+        self._marks_writer.flush()
+        diverged = self._diverged_marks(path)
+        if diverged is None:
+            return False
+
+        base, theirs = diverged
+        template = self._template
+        result = merge_marks(
+            template,
+            template.parse_md(base)[0],
+            template.marks_of(self._rubric),
+            template.parse_md(theirs)[0],
+        )
+        self._marks_base[path] = (blob_hash(theirs), theirs)
+        # Apply silently, the merged marks are written once at the end
+        self._rubric.on_change(None)
+        try:
+            changed = template.apply(self._rubric, result.marks)
+        finally:
+            self._rubric.on_change(self._write_marks)
+        print(f"Merged {changed} changes into {self._student_number}'s marks")
+
+        if result.conflicts:
+            self._app.notify(
+                message=f"{self._student_number}'s marks were also changed by "
+                "someone else, kept yours for:\n" + "\n".join(result.conflicts),
+                severity="warning",
+            )
+        else:
+            self._app.notify(
+                message=f"Merged someone else's changes to {self._student_number}'s marks"
+            )
+        self._write_marks()
+        if self._marks_merged_callback:
+            self._marks_merged_callback()
+        return True
+
+    def on_checked_out(self, callback: Optional[Callable[[], None]]) -> None:
+        """
+        Sets a function to call on the UI thread when the current student's
+        repo has been checked out in the background.
+        """
+        self._checked_out_callback = callback
+
+    def on_marks_merged(self, callback: Optional[Callable[[], None]]) -> None:
+        """
+        Sets a callback for when merge_marks_from_disk changes the rubric.
+        """
+        self._marks_merged_callback = callback
+
+    def _merge_marks_file(
+        self, path: str, base: str, ours: str, theirs: str
+    ) -> Optional[Tuple[str, List[str]]]:
+        """
+        Three-way merges a <student>/<stage>/marks.md of the marks repo for
+        MarksSync, using the current semester's criteria for its stage.
+        """
+        parts = path.split("/")
+        if len(parts) != 3 or not self._year or not self._semester:
+            return None
+        for stage in self._criteria.stages():
+            if self._normalize_stage_dir(stage) != parts[1]:
+                continue
+            try:
+                template = self.get_criteria(self._year, self._semester, stage)
+            except FileNotFoundError:
+                return None
+            return merge_marks_md(template, base, ours, theirs)
+        return None
+
+    def _on_marks_write_error(self, path: str, error: Exception) -> None:
+        """
+        Called from the marks writer's thread when saving fails. Never waits
+        on the UI thread, which may be in flush_marks() waiting on the writer.
+        """
+        # What's on disk is no longer what we think we wrote
+        self._marks_base.pop(path, None)
+        self._app.call_later(
+            self._app.notify,
+            message=f"Couldn't save marks to {path}: {error}",
+            severity="error",
+        )
+
+    def flush_marks(self) -> None:
         """
-        Initializes the Gitea client using the token in TOKEN_PATH.
+        Saves any marks edits that are still waiting to be written.
         """
-        with open(TOKEN_PATH) as file:
-            token = file.read().strip()
-        return Gitea(GITEA_URL, token)
+        self._marks_writer.flush()
+
+    @property
+    def _gitea(self) -> "Gitea":
+        """
+        The shared Gitea client (see giteaclient), created the first time
+        it's needed, which is normally by warm_up off the UI thread.
+        """
+        return get_client(self._token)
 
     def _load_latest_commits(self) -> Dict[str, Dict[str, str]]:
         """
@@ -275,49 +499,230 @@ class AppState:
         if not self._student_number or not self._stage:
             return
 
-        new_commit_hash = None
-
-        # Check if there's a matching commit hash in _latest_commits
-        if self._stage in self._latest_commits:
-            stage_commits = self._latest_commits[self._stage]
-            new_commit_hash = stage_commits.get(self._student_number)
+        new_commit_hash = self._marked_commit(self._student_number)
 
         if new_commit_hash and new_commit_hash != self._commit_hash:
             print(f"Updating commit hash for {self._student_number}: {new_commit_hash}")
             self._commit_hash = new_commit_hash
             self._clone_student_repo()
 
-    def _load_students(self):
+    def _marked_commit(self, student_number: str) -> Optional[str]:
         """
-        Load all students (sXXXXXXX accounts) and cache them.
+        Returns the commit from latest_commits.json to mark for the student
+        in the current stage, if there is one.
         """
-        users = self._gitea.get_users()
-        for user in users:
-            if self._is_student_user(user):
-                self._students[user.username] = user
+        if not self._stage:
+            return None
+        commit = self._latest_commits.get(self._stage, {}).get(student_number)
+        if not commit or commit == NO_COMMITS:
+            return None
+        return commit
 
-    def _load_criteria(self):
+    def _upcoming_students(self) -> List[str]:
         """
-        Loads all .yaml criteria files into memory for quick searching.
+        Returns the students after the current one, in marking order: the
+        order of the stage's latest_commits.json entries, or the roster's.
         """
-        criteria_root = os.path.join(".", "criteria")
-        all_paths = _list_files(criteria_root)
+        order = list(self._latest_commits.get(self._stage or "", {}))
+        if self._student_number not in order:
+            order = sorted(self._students)
+        if self._student_number not in order:
+            return []
+        index = order.index(self._student_number)
+        return order[index + 1 :] + order[:index]
 
-        self._criteria_list.clear()
-        for path in all_paths:
-            if path.endswith(".yaml"):
-                with open(path, "r") as file:
-                    data = file.read()
-                    crit = Rubric.from_yaml(data)
-                    self._criteria_list.append(crit)
+    def _prefetch_next(self) -> None:
+        """
+        Queues the next few students' repos to be checked out in the background.
+        """
+        upcoming = []
+        for student_number in self._upcoming_students():
+            student = self._students.get(student_number)
+            if student and student.has_repo:
+                upcoming.append(
+                    (
+                        student_number,
+                        student.ssh_url,
+                        self._marked_commit(student_number),
+                    )
+                )
+            if len(upcoming) >= self._prefetcher.count:
+                break
+        self._prefetcher.schedule(self._student_number, upcoming)
 
-    def _is_student_user(self, user: User) -> bool:
-        pattern = r"s\d{7}"
-        return bool(re.search(pattern, user.username))
+    def build_key(self, target: str = "") -> Optional[BuildKey]:
+        """
+        Returns the build cache key for the current commit and stage, or None
+        if the current checkout can't be cached: no commit is selected, or
+        it has been edited since it was checked out.
+        """
+        if not self._commit_hash or not self._stage or not self._student_number:
+            return None
+        if "SOURCELIB_ROOT" not in os.environ:
+            return None
+        local_dir = self._repo_store.worktree_path(self._student_number)
+        if not self._repo_store.is_clean(local_dir):
+            return None
+        return make_key(
+            self._commit_hash, self._stage, os.environ["SOURCELIB_ROOT"], target
+        )
 
-    def _clone_marks_repo_if_ready(self):
-        from textual.widgets import Select
+    def prebuilt_result(self) -> Optional[BuildResult]:
+        """
+        Returns the cached build result for the current commit and stage, if any.
+        """
+        key = self.build_key()
+        return load_result(key, self._student_number or "") if key else None
+
+    def build_current(
+        self, key: BuildKey, on_output: Callable[[bytes], None], force: bool = False
+    ) -> BuildResult:
+        """
+        Builds the current student's commit in the build cache, or returns
+        the cached result unless force is set. Blocks, so run it from a
+        background worker.
+        """
+        student = self._students.get(self._student_number or "")
+        return get_or_build(
+            self._repo_store,
+            self._student_number,
+            student.ssh_url if student else None,
+            key,
+            os.environ["SOURCELIB_ROOT"],
+            on_output,
+            force,
+        )
+
+    def build_stage(
+        self, sourcelib_root: str, on_result: Callable[[BuildResult], None]
+    ) -> List[BuildResult]:
+        """
+        Pre-builds every student's marked commit for the current stage, see
+        build.build_stage. Blocks, so run it from a background worker.
+        """
+        if not self._stage:
+            return []
+        return build_stage(
+            self._repo_store,
+            self._students,
+            self._stage,
+            self._latest_commits.get(self._stage, {}),
+            sourcelib_root,
+            on_result=on_result,
+        )
+
+    def commit_marks_if_due(self) -> List[str]:
+        """
+        Commits the marks repo locally once enough students have changes.
+        Returns the students committed. Blocks, so run it from a worker.
+        """
+        if not self._marks_sync:
+            return []
+        self._marks_writer.flush()
+        try:
+            return self._marks_sync.commit_if_due()
+        except Exception as e:
+            print(f"Could not commit marks: {e}")
+            return []
+
+    def sync_marks(self, report: Callable[[str], None]) -> SyncResult:
+        """
+        Commits all changed marks in one commit, then fetches, rebases and
+        pushes the marks repo, see MarksSync.sync. Marks aren't written
+        while the checkout is being rebased. Blocks, so run it from a
+        background worker.
+        """
+        if not self._marks_sync:
+            return SyncResult(failed=True, message="No marks repo for this semester")
+        try:
+            return self._marks_sync.sync(report, hold=self._marks_writer.paused)
+        except Exception as e:
+            print(f"Could not sync marks: {e}")
+            return SyncResult(failed=True, message=f"Sync failed: {e}")
 
+    def shutdown(self) -> None:
+        """
+        Stops any background work, call when the app exits.
+        Pending marks are written and committed (but not pushed) first.
+        """
+        self._marks_writer.shutdown()
+        stats = client_stats()
+        if stats:
+            print(stats.summary())
+        if self._marks_sync:
+            try:
+                self._marks_sync.commit()
+            except Exception as e:
+                print(f"Could not commit marks: {e}")
+        self._prefetcher.shutdown()
+
+    def warm_up(self, report: Callable[[WarmUpProgress], None]) -> None:
+        """
+        Loads everything the UI does not need for its first frame: parses the
+        criteria index and revalidates the student roster against Gitea.
+        Blocks, so it is meant to be run from a background worker; report is
+        called after each step so the UI can stream the results in.
+        """
+        with STARTUP.phase("criteria"):
+            self._load_criteria(report)
+        with STARTUP.phase("roster"):
+            self._load_students(report)
+        with STARTUP.phase("gitea"):
+            self._load_gitea_info(report)
+
+    def _load_students(self, report: Callable[[WarmUpProgress], None]) -> None:
+        """
+        Load all students (sXXXXXXX accounts) along with their org and repo.
+        A fresh on-disk roster is used as-is, otherwise it is revalidated.
+        """
+        if self._roster and self._roster.is_fresh():
+            report(WarmUpProgress("students", 1, 1, "Roster loaded from cache"))
+            return
+
+        def on_progress(done: int, total: int, students: List[Student]) -> None:
+            report(
+                WarmUpProgress(
+                    "students", done, max(total, 1), "Fetching roster", students
+                )
+            )
+
+        try:
+            roster = fetch_roster(self._gitea, self._roster, on_progress=on_progress)
+        except Exception as e:
+            print(f"Failed to fetch roster: {e}")
+            report(WarmUpProgress("students", 1, 1, "Roster fetch failed"))
+            return
+
+        save_roster(roster)
+        self._roster = roster
+        self._students = roster.students
+        report(WarmUpProgress("students", 1, 1, "Roster up to date"))
+
+    def _load_criteria(self, report: Callable[[WarmUpProgress], None]) -> None:
+        """
+        Indexes the .yaml criteria files by year/semester/stage. Only their
+        headers are read here, rubrics are parsed when first selected.
+        """
+
+        def on_progress(done: int, total: int, path: str) -> None:
+            report(WarmUpProgress("criteria", done, total, path))
+
+        self._criteria.scan(on_progress)
+        if not self._criteria.stages():
+            report(WarmUpProgress("criteria", 1, 1, "No criteria found"))
+
+    def _load_gitea_info(self, report: Callable[[WarmUpProgress], None]) -> None:
+        """
+        Fetches the Gitea version and the logged in user for the banner.
+        """
+        try:
+            self.gitea_version = self._gitea.get_version()
+            self.gitea_user = self._gitea.get_user().username
+        except Exception as e:
+            print(f"Failed to query Gitea: {e}")
+        report(WarmUpProgress("gitea", 1, 1))
+
+    def _clone_marks_repo_if_ready(self):
         if (
             self._year
             and self._semester
@@ -330,39 +735,62 @@ class AppState:
     def _reload_rubric(self) -> None:
         """
         Try to load the rubric for the current year/semester/stage from .yaml.
-        If found, store it in self._rubric. If not found, set self._rubric = None.
+        If found, store a fresh copy of it in self._rubric. If not found, set
+        self._rubric = None.
         If we have a student set, also read the student's existing marks from .md
         into the rubric, then write it back to ensure everything stays synced.
         """
         if not all([self._year, self._semester, self._stage]):
-            self._rubric = None
+            self._drop_rubric()
             return
 
         # Attempt to load from YAML
         try:
-            loaded = self.get_criteria(self._year, self._semester, self._stage)
+            template = self.get_criteria(self._year, self._semester, self._stage)
         except FileNotFoundError:
             print(f"No matching rubric for {self._year}/{self._semester}/{self._stage}")
-            self._rubric = None
+            self._drop_rubric()
             return
 
-        loaded.clear_marks()
+        # A fresh copy per student, the template itself is never marked
+        loaded = template.instantiate()
+        self._template = template
+        self._rubric_path = self._marks_path()
 
         # If we have a student selected, try to read that student's .md
         if self._student_number:
             existing_md = self._read_marks()
             if existing_md:
-                loaded.load_md(existing_md)
+                diagnostics = loaded.load_md(existing_md)
+                if diagnostics:
+                    self._app.notify(
+                        message=f"Problems in {self._student_number}'s marks.md:\n"
+                        + "\n".join(map(str, diagnostics)),
+                        severity="warning",
+                    )
 
         self.rubric = loaded
         self.refresh_current_hash()
 
+    def _drop_rubric(self) -> None:
+        """
+        Unloads the current rubric, detaching it so it can't write any more marks.
+        """
+        if self._rubric is not None:
+            self._rubric.on_change(None)
+        self._rubric = None
+        self._rubric_path = None
+        self._template = None
+
     def _clone_student_repo(self) -> None:
         """
-        Clones the current student's repository into temporary/repo/<student_number>.
-        If self._commit_hash is not None, checks out that commit.
-        If the directory already exists, tries to open it as a git repo and optionally
-        checkout the commit. If that fails, removes the directory and starts fresh.
+        Checks out the current student's repository into temporary/repo/<student_number>,
+        as a worktree of the shared repo store (see RepoStore).
+        If self._commit_hash is not None, checks out that commit, otherwise the tip
+        of their default branch. Objects are fetched incrementally into the store,
+        and a corrupted checkout is repaired by recreating its worktree.
+        If anything has to be fetched that happens in the background, and
+        on_checked_out's callback is called once it's done.
         """
         if not self._student_number:
             return
@@ -372,43 +800,49 @@ class AppState:
             print(f"No student found for {self._student_number}")
             return
 
-        repo = self._get_student_repo(student)
-        if not repo:
+        if not student.has_repo:
             print(f"No repository found for student {self._student_number}")
             return
 
-        local_dir = os.path.join("temporary", "repo", self._student_number)
+        student_number, commit = self._student_number, self._commit_hash
+        try:
+            checkout = self._prefetcher.checkout(
+                student_number, student.ssh_url, commit
+            )
+        finally:
+            self._prefetch_next()
+        if checkout.done():
+            self._on_checked_out(student_number, commit, checkout, background=False)
+            return
+        print(f"Fetching {student_number}'s repo in the background")
+        checkout.add_done_callback(
+            lambda done: self._app.call_later(
+                self._on_checked_out, student_number, commit, done
+            )
+        )
 
-        if not os.path.exists(local_dir):
-            os.makedirs(local_dir, exist_ok=True)
-            try:
-                print(f"Cloning {self._student_number}'s repo into: {local_dir}")
-                cloned_repo = Repo.clone_from(repo.ssh_url, local_dir)
-                if self._commit_hash:
-                    cloned_repo.git.checkout(self._commit_hash)
-            except Exception as e:
-                print(f"Could not clone {self._student_number}'s repo:\n{e}")
-        else:
-            # Directory exists: check if it's a valid repo
-            try:
-                existing_repo = Repo(local_dir)
-                if self._commit_hash:
-                    existing_repo.git.checkout(self._commit_hash)
-                print(
-                    f"Repo for {self._student_number} already exists; used existing clone."
-                )
-            except Exception as e:
-                print(
-                    f"Existing directory is invalid or corrupted ({e}). Removing and re-cloning."
-                )
-                shutil.rmtree(local_dir)
-                os.makedirs(local_dir, exist_ok=True)
-                try:
-                    cloned_repo = Repo.clone_from(repo.ssh_url, local_dir)
-                    if self._commit_hash:
-                        cloned_repo.git.checkout(self._commit_hash)
-                except Exception as e2:
-                    print(f"Failed to re-clone {self._student_number}'s repo:\n{e2}")
+    def _on_checked_out(
+        self,
+        student_number: str,
+        commit: Optional[str],
+        checkout: Future,
+        background: bool = True,
+    ) -> None:
+        """
+        Finishes _clone_student_repo on the UI thread: links the checkout
+        into sourcelib, unless another student or commit was picked since.
+        """
+        if (student_number, commit) != (self._student_number, self._commit_hash):
+            return
+        try:
+            local_dir = checkout.result()
+        except Exception as e:
+            print(f"Could not check out {student_number}'s repo:\n{e}")
+            self._app.notify(
+                message=f"Could not check out {student_number}'s repo: {e}",
+                severity="error",
+            )
+            return
 
         # Symlink the directory to $SOURCELIB_ROOT/repo
         if "SOURCELIB_ROOT" in os.environ:
@@ -421,6 +855,8 @@ class AppState:
             os.symlink(os.path.abspath(local_dir), target)
         else:
             self._app.notify(message="SOURCELIB_ROOT is not set.", severity="error")
+        if background and self._checked_out_callback:
+            self._checked_out_callback()
 
     def _clone_marks_repo(self):
         """
@@ -428,8 +864,21 @@ class AppState:
         if not already cloned. It does NOT pull or overwrite any changes
         to avoid accidental data loss.
         """
-        url = f"git@csse3010-gitea.zones.eait.uq.edu.au:uqmdsouz/marking_sem{self._semester}_{self._year}.git"
         repo_dir = self._marks_directory
+        try:
+            self._clone_marks_repo_into(repo_dir)
+        finally:
+            self._marks_index = MarksIndex(repo_dir)
+            self._marks_index.refresh()
+            print(f"Indexed {len(self._marks_index.students())} students' marks")
+            if os.path.isdir(os.path.join(repo_dir, ".git")):
+                self._marks_sync = MarksSync(repo_dir, merge=self._merge_marks_file)
+
+    def _clone_marks_repo_into(self, repo_dir: str) -> None:
+        import git
+        from git import Repo
+
+        url = f"git@csse3010-gitea.zones.eait.uq.edu.au:uqmdsouz/marking_sem{self._semester}_{self._year}.git"
 
         if not os.path.exists(repo_dir):
             os.makedirs(repo_dir, exist_ok=True)
@@ -464,26 +913,7 @@ class AppState:
         For a given stage string (e.g. 'pf', '1', 'S2'), returns
         the directory name as 'pf' or 's1', 's2' etc.
         """
-        stage = stage.lower()
-        if stage != "pf" and not stage.startswith("s"):
-            stage = f"s{stage}"
-        return stage
-
-    def _get_student_repo(self, student: User) -> Optional[Repository]:
-        """
-        Given a student user, find their 'repo' repository inside an org
-        that corresponds to their student number.
-        """
-        if not self._is_student_user(student):
-            return None
-        username = student.username
-        # We try to find an org that "contains" the last digits of the username
-        for org in student.get_orgs():
-            if username[1:] in org.name:
-                for r in org.get_repositories():
-                    if r.name == "repo":
-                        return r
-        return None
+        return normalize_stage_dir(stage)
 
 
 # Example usage:
@@ -0,0 +1,448 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field, replace
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+from csse3010_tools.hashes import NO_COMMITS
+from csse3010_tools.repostore import RepoStore, dir_size
+from csse3010_tools.roster import Student, load_roster
+
+# Build cache. Every BuildKey gets its own entry, which is also the sandbox
+# the build ran in:
+#   temporary/build/<key digest>/repo         worktree of the student's repo
+#   temporary/build/<key digest>/sourcelib    links to $SOURCELIB_ROOT's contents
+#   temporary/build/<key digest>/build.log
+#   temporary/build/<key digest>/result.json
+# With SOURCELIB_ROOT pointed at the sandbox, $SOURCELIB_ROOT/../repo resolves
+# to the sandbox's own checkout without the global symlink the interactive
+# build uses. Keeping the sandbox means flashing a cached build only runs
+# 'make flash' on up to date objects.
+BUILD_ROOT = os.path.join("temporary", "build")
+
+# Entries are evicted least recently used first beyond this size.
+BUILD_CACHE_BUDGET = 8 * 1024**3
+
+BUILD_JOBS = os.cpu_count() or 4
+
+ARTEFACT_EXTENSIONS = (".elf", ".bin", ".hex")
+
+TOOLCHAIN_COMPILER = "arm-none-eabi-gcc"
+
+OUTPUT_CHUNK_SIZE = 64 * 1024
+
+# A failed build with none of these in its log didn't fail on the student's
+# code (make was killed, the toolchain is missing...), so isn't cached.
+COMPILER_DIAGNOSTICS = re.compile(
+    rb": (fatal )?error: |undefined reference to|multiple definition of"
+)
+
+_evict_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class BuildKey:
+    commit: str
+    stage: str
+    sourcelib: str
+    toolchain: str
+    # make target, "" for the Makefile's default goal
+    target: str = ""
+
+    def digest(self) -> str:
+        data = json.dumps(asdict(self), sort_keys=True).encode("utf8")
+        return hashlib.sha256(data).hexdigest()[:32]
+
+
+@dataclass
+class BuildResult:
+    # Who it was built for. Students with the same commit share one cache
+    # entry, so this isn't saved with it.
+    student: str
+    commit: str
+    stage: str
+    success: bool
+    returncode: int
+    duration: float
+    log_path: str
+    artefacts: List[str] = field(default_factory=list)
+    target: str = ""
+    size: int = 0
+    # False if it failed for some reason other than the code, build it again
+    cacheable: bool = True
+
+    def summary(self) -> str:
+        status = "OK" if self.success else f"FAILED ({self.returncode})"
+        return f"{status} in {self.duration:.1f}s"
+
+
+def normalize_stage_dir(stage: str) -> str:
+    """
+    For a given stage string (e.g. 'pf', '1', 'S2'), returns
+    the directory name as 'pf' or 's1', 's2' etc.
+    """
+    stage = stage.lower()
+    if stage != "pf" and not stage.startswith("s"):
+        stage = f"s{stage}"
+    return stage
+
+
+@lru_cache(maxsize=None)
+def sourcelib_revision(sourcelib_root: str) -> str:
+    """
+    The commit sourcelib is checked out at, or its path if it isn't in git.
+    """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=sourcelib_root,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except Exception:
+        return os.path.abspath(sourcelib_root)
+
+
+@lru_cache(maxsize=None)
+def toolchain_version() -> str:
+    try:
+        output = subprocess.check_output(
+            [TOOLCHAIN_COMPILER, "--version"], stderr=subprocess.DEVNULL, text=True
+        )
+        return output.splitlines()[0]
+    except Exception:
+        return "unknown"
+
+
+def make_key(
+    commit: str, stage: str, sourcelib_root: str, target: str = ""
+) -> BuildKey:
+    return BuildKey(
+        commit=commit,
+        stage=normalize_stage_dir(stage),
+        sourcelib=sourcelib_revision(os.path.abspath(sourcelib_root)),
+        toolchain=toolchain_version(),
+        target=target,
+    )
+
+
+def entry_dir(key: BuildKey) -> str:
+    return os.path.join(BUILD_ROOT, key.digest())
+
+
+def build_dir(key: BuildKey) -> str:
+    """
+    Where make runs for the key, inside its sandbox.
+    """
+    return os.path.join(entry_dir(key), "repo", key.stage)
+
+
+def load_result(key: BuildKey, student: str = "") -> Optional[BuildResult]:
+    """
+    Returns the cached result of building key for student, if any, and
+    marks it as used.
+    """
+    path = os.path.join(entry_dir(key), "result.json")
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r") as f:
+            result = BuildResult(**{**json.load(f), "student": student})
+        if not result.cacheable:
+            return None
+        os.utime(entry_dir(key))
+        return result
+    except Exception as e:
+        print(f"Failed to read build result {path}: {e}")
+        return None
+
+
+def _link_sourcelib(sourcelib_root: str, target: str) -> None:
+    """
+    Makes target a real directory of symlinks to sourcelib's entries,
+    so that target/.. is the sandbox rather than sourcelib's parent.
+    """
+    os.makedirs(target, exist_ok=True)
+    for name in os.listdir(sourcelib_root):
+        link = os.path.join(target, name)
+        if not os.path.lexists(link):
+            os.symlink(os.path.join(sourcelib_root, name), link)
+
+
+def prepare_sandbox(
+    store: RepoStore,
+    student: str,
+    ssh_url: Optional[str],
+    key: BuildKey,
+    sourcelib_root: str,
+) -> str:
+    """
+    Sets up the key's build sandbox, reusing it if it already exists.
+    """
+    sandbox = entry_dir(key)
+    repo_dir = os.path.join(sandbox, "repo")
+    if not os.path.isfile(os.path.join(repo_dir, ".git")):
+        if not store.has_commit(key.commit):
+            store.fetch(student, ssh_url)
+        store.add_worktree(repo_dir, key.commit)
+    _link_sourcelib(os.path.abspath(sourcelib_root), os.path.join(sandbox, "sourcelib"))
+    return sandbox
+
+
+def _remove_entry(store: RepoStore, path: str) -> None:
+    store.remove_worktree_at(os.path.join(path, "repo"))
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def sandbox_env(key: BuildKey) -> Dict[str, str]:
+    env = dict(os.environ)
+    env["SOURCELIB_ROOT"] = os.path.abspath(os.path.join(entry_dir(key), "sourcelib"))
+    return env
+
+
+def build_commit(
+    store: RepoStore,
+    student: str,
+    ssh_url: Optional[str],
+    key: BuildKey,
+    sourcelib_root: str,
+    on_output: Optional[Callable[[bytes], None]] = None,
+    clean: bool = False,
+) -> BuildResult:
+    """
+    Builds one student's stage at the key's commit in its own sandbox,
+    recording the log, exit status and build time in the cache.
+    on_output, if given, is passed the build output as it is produced.
+    With clean, any existing sandbox is thrown away first so everything
+    is compiled again, rather than make finding nothing to do.
+    """
+    if clean:
+        _remove_entry(store, entry_dir(key))
+    sandbox = prepare_sandbox(store, student, ssh_url, key, sourcelib_root)
+    make_dir = build_dir(key)
+    log_path = os.path.join(sandbox, "build.log")
+
+    start = time.monotonic()
+    with open(log_path, "wb") as log:
+        if os.path.isdir(make_dir):
+            command = ["make"] + ([key.target] if key.target else [])
+            with subprocess.Popen(
+                command,
+                cwd=make_dir,
+                env=sandbox_env(key),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+            ) as p:
+                while chunk := p.stdout.read1(OUTPUT_CHUNK_SIZE):
+                    log.write(chunk)
+                    if on_output:
+                        on_output(chunk)
+            returncode = p.returncode
+        else:
+            message = f"No {key.stage} directory in this commit\n".encode("utf8")
+            log.write(message)
+            if on_output:
+                on_output(message)
+            returncode = -1
+    duration = time.monotonic() - start
+    cacheable = returncode == 0 or not os.path.isdir(make_dir)
+    if returncode > 0 and not cacheable:
+        with open(log_path, "rb") as log:
+            cacheable = bool(COMPILER_DIAGNOSTICS.search(log.read()))
+
+    artefacts = []
+    if os.path.isdir(make_dir):
+        for root, _, files in os.walk(make_dir):
+            artefacts += [
+                os.path.join(root, f) for f in files if f.endswith(ARTEFACT_EXTENSIONS)
+            ]
+
+    result = BuildResult(
+        student=student,
+        commit=key.commit,
+        stage=key.stage,
+        success=returncode == 0,
+        returncode=returncode,
+        duration=duration,
+        log_path=log_path,
+        artefacts=artefacts,
+        target=key.target,
+        size=dir_size(sandbox),
+        cacheable=cacheable,
+    )
+    saved = asdict(result)
+    del saved["student"]
+    with open(os.path.join(sandbox, "result.json"), "w") as f:
+        json.dump(saved, f, indent=1)
+    return result
+
+
+def get_or_build(
+    store: RepoStore,
+    student: str,
+    ssh_url: Optional[str],
+    key: BuildKey,
+    sourcelib_root: str,
+    on_output: Optional[Callable[[bytes], None]] = None,
+    force: bool = False,
+) -> BuildResult:
+    """
+    Returns the cached result for key, building it first on a miss. With
+    force it is built again from a fresh sandbox.
+    """
+    cached = None if force else load_result(key, student)
+    if cached:
+        return cached
+    result = build_commit(
+        store, student, ssh_url, key, sourcelib_root, on_output, clean=force
+    )
+    evict(store, keep=frozenset({key.digest()}))
+    return result
+
+
+def evict(
+    store: RepoStore, budget: int = BUILD_CACHE_BUDGET, keep: frozenset = frozenset()
+) -> None:
+    """
+    Removes least recently used cache entries until they fit in the budget.
+    """
+    if not os.path.isdir(BUILD_ROOT):
+        return
+    with _evict_lock:
+        entries = []
+        for digest in os.listdir(BUILD_ROOT):
+            path = os.path.join(BUILD_ROOT, digest)
+            try:
+                with open(os.path.join(path, "result.json"), "r") as f:
+                    size = json.load(f).get("size", 0)
+            except Exception:
+                continue  # Still building, or broken
+            entries.append((os.stat(path).st_mtime, digest, size))
+
+        total = sum(size for _, _, size in entries)
+        for _, digest, size in sorted(entries):
+            if total <= budget:
+                break
+            if digest in keep:
+                continue
+            print(f"Evicting build {digest} ({size // 1024**2} MiB)")
+            _remove_entry(store, os.path.join(BUILD_ROOT, digest))
+            total -= size
+
+
+def build_stage(
+    store: RepoStore,
+    students: Dict[str, Student],
+    stage: str,
+    commits: Dict[str, str],
+    sourcelib_root: str,
+    jobs: int = BUILD_JOBS,
+    force: bool = False,
+    on_result: Optional[Callable[[BuildResult], None]] = None,
+) -> List[BuildResult]:
+    """
+    Builds every student's marked commit for the stage concurrently, each in
+    its own sandbox. Commits already in the build cache are not rebuilt
+    unless force is set, in which case they are built from scratch.
+    Students with the same commit (say, untouched skeletons) share a single
+    build, reported for each of them.
+    """
+    results = []
+    # digest -> (key, the students it is built for, ssh url to fetch from)
+    to_build: Dict[str, Tuple[BuildKey, List[str], Optional[str]]] = {}
+    for student, commit in commits.items():
+        if not commit or commit == NO_COMMITS:
+            continue
+        key = make_key(commit, stage, sourcelib_root)
+        cached = None if force else load_result(key, student)
+        if cached:
+            results.append(cached)
+            if on_result:
+                on_result(cached)
+            continue
+        if key.digest() in to_build:
+            to_build[key.digest()][1].append(student)
+        else:
+            info = students.get(student)
+            to_build[key.digest()] = (key, [student], info.ssh_url if info else None)
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            pool.submit(
+                build_commit,
+                store,
+                group[0],
+                ssh_url,
+                key,
+                sourcelib_root,
+                clean=force,
+            ): group
+            for key, group, ssh_url in to_build.values()
+        }
+        for future in as_completed(futures):
+            group = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Could not build {', '.join(group)}: {e}")
+                continue
+            for student in group:
+                shared = replace(result, student=student)
+                results.append(shared)
+                if on_result:
+                    on_result(shared)
+
+    keep = frozenset(
+        make_key(r.commit, stage, sourcelib_root).digest() for r in results
+    )
+    evict(store, keep=keep)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pre-build every student's marked commit for a stage."
+    )
+    parser.add_argument("stage", help="stage name as in latest_commits.json, e.g. s1")
+    parser.add_argument("--jobs", type=int, default=BUILD_JOBS)
+    parser.add_argument(
+        "--force", action="store_true", help="rebuild commits that are already cached"
+    )
+    args = parser.parse_args()
+
+    if "SOURCELIB_ROOT" not in os.environ:
+        print("SOURCELIB_ROOT is not set.")
+        return
+
+    with open("latest_commits.json", "r") as f:
+        commits = json.load(f).get(args.stage, {})
+    roster = load_roster()
+    students = roster.students if roster else {}
+
+    def on_result(result: BuildResult) -> None:
+        print(f"{result.student} {result.commit[:10]}: {result.summary()}")
+
+    results = build_stage(
+        RepoStore(),
+        students,
+        args.stage,
+        commits,
+        os.environ["SOURCELIB_ROOT"],
+        jobs=args.jobs,
+        force=args.force,
+        on_result=on_result,
+    )
+    passed = len([r for r in results if r.success])
+    print(f"{passed}/{len(results)} builds passed")
+
+
+if __name__ == "__main__":
+    main()
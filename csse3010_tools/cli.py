@@ -0,0 +1,219 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+# Only what a subcommand needs is imported when it runs, so nothing here
+# pulls in textual, and gitea only for the commands that talk to it.
+
+LATEST_COMMITS_PATH = "latest_commits.json"
+
+
+def _roster(args) -> int:
+    from csse3010_tools.hashes import get_gitea_client
+    from csse3010_tools.roster import fetch_roster, load_roster, save_roster
+
+    previous = None if args.rebuild else load_roster()
+    if previous and previous.is_fresh() and not args.force:
+        print(f"Roster is fresh: {len(previous.students)} students")
+        return 0
+    roster = fetch_roster(get_gitea_client(), previous)
+    save_roster(roster)
+    return 0
+
+
+def _hashes(args) -> int:
+    from csse3010_tools import hashes
+
+    return hashes.main(
+        [] if args.tasks == ["all"] else args.tasks,
+        local=args.local,
+        fetch=not args.no_fetch,
+        policy=args.policy,
+    )
+
+
+def _load_stage_commits(stage: str) -> dict:
+    if not os.path.exists(LATEST_COMMITS_PATH):
+        return {}
+    with open(LATEST_COMMITS_PATH, "r") as f:
+        return json.load(f).get(stage, {})
+
+
+def _clone(args) -> int:
+    from csse3010_tools.hashes import (
+        NO_COMMITS,
+        RESOLVER_WORKERS,
+        list_local_students,
+        sync_local_store,
+    )
+    from csse3010_tools.repostore import RepoStore
+
+    store = RepoStore()
+    students = list_local_students(store)
+    print(f"Fetching {len(students)} repos into the store")
+    fetched = sync_local_store(store, students, workers=args.jobs or RESOLVER_WORKERS)
+    print(f"{len(fetched)}/{len(students)} repos fetched")
+    if not args.stage:
+        return 0 if len(fetched) == len(students) else 1
+
+    # Check out everyone's marked commit, ready to be marked or built
+    commits = _load_stage_commits(args.stage)
+    failed = 0
+    for student in sorted(fetched):
+        commit = commits.get(student)
+        try:
+            store.checkout(student, commit=None if commit == NO_COMMITS else commit)
+        except Exception as e:
+            print(f"{student}: could not check out {commit}: {e}")
+            failed += 1
+    return 1 if failed else 0
+
+
+def _build(args) -> int:
+    from csse3010_tools.build import BUILD_JOBS, BuildResult, build_stage
+    from csse3010_tools.repostore import RepoStore
+    from csse3010_tools.roster import load_roster
+
+    if "SOURCELIB_ROOT" not in os.environ:
+        print("SOURCELIB_ROOT is not set.")
+        return 1
+    roster = load_roster()
+
+    def on_result(result: BuildResult) -> None:
+        print(f"{result.student} {result.commit[:10]}: {result.summary()}")
+
+    results = build_stage(
+        RepoStore(),
+        roster.students if roster else {},
+        args.stage,
+        _load_stage_commits(args.stage),
+        os.environ["SOURCELIB_ROOT"],
+        jobs=args.jobs or BUILD_JOBS,
+        force=args.force,
+        on_result=on_result,
+    )
+    passed = len([r for r in results if r.success])
+    print(f"{passed}/{len(results)} builds passed")
+    return 0 if passed == len(results) else 1
+
+
+def _export(args) -> int:
+    from csse3010_tools.export import EXPORT_JOBS, EXPORT_ROOT, export_marks
+
+    tables = export_marks(
+        args.year,
+        args.semester,
+        args.stages,
+        args.output or EXPORT_ROOT,
+        args.format,
+        args.jobs or EXPORT_JOBS,
+    )
+    return 0 if tables else 1
+
+
+def _validate(args) -> int:
+    from csse3010_tools.criteria import CriteriaIndex
+    from csse3010_tools.export import (
+        EXPORT_JOBS,
+        collect_marks,
+        marks_directory,
+        stage_templates,
+    )
+    from csse3010_tools.marksindex import MarksIndex
+
+    criteria = CriteriaIndex()
+    criteria.scan()
+    templates, missing = stage_templates(
+        criteria, args.year, args.semester, args.stages
+    )
+    if missing:
+        return 1
+    index = MarksIndex(marks_directory(args.year, args.semester))
+    index.refresh()
+
+    errors = 0
+    for stage, table in collect_marks(
+        index, templates, args.jobs or EXPORT_JOBS
+    ).items():
+        for path, error in sorted(table.errors.items()):
+            print(f"{path}: {error}")
+        errors += len(table.errors)
+        print(f"{stage}: {table.rows} marks files, {len(table.errors)} with problems")
+    return 1 if errors else 0
+
+
+def main():
+    # Cheap, hashes only pulls in gitea once it talks to it
+    from csse3010_tools.hashes import TIME_POLICIES
+
+    parser = argparse.ArgumentParser(
+        prog="csse3010",
+        description="Batch marking jobs, without the UI. Exits non-zero if "
+        "anything failed, for running from cron.",
+    )
+    commands = parser.add_subparsers(required=True, metavar="command")
+
+    roster = commands.add_parser("roster", help="revalidate the student roster")
+    roster.add_argument(
+        "--force", action="store_true", help="even if the cached roster is fresh"
+    )
+    roster.add_argument(
+        "--rebuild", action="store_true", help="resolve every student again"
+    )
+    roster.set_defaults(run=_roster)
+
+    hashes = commands.add_parser(
+        "hashes", help="find each student's last commit before a task's deadline"
+    )
+    hashes.add_argument("tasks", nargs="+", help="task names, or 'all'")
+    hashes.add_argument("--local", action="store_true")
+    hashes.add_argument("--no-fetch", action="store_true")
+    hashes.add_argument("--policy", choices=TIME_POLICIES, default="committer")
+    hashes.set_defaults(run=_hashes)
+
+    clone = commands.add_parser("clone", help="fetch every student's repo")
+    clone.add_argument(
+        "--stage", help="also check out each student's marked commit for the stage"
+    )
+    clone.add_argument("--jobs", type=int)
+    clone.set_defaults(run=_clone)
+
+    build = commands.add_parser("build", help="pre-build every marked commit")
+    build.add_argument("stage")
+    build.add_argument("--jobs", type=int)
+    build.add_argument("--force", action="store_true")
+    build.set_defaults(run=_build)
+
+    for name, run, summary in (
+        ("export", _export, "export every student's marks"),
+        ("validate", _validate, "report marks files that don't parse cleanly"),
+    ):
+        command = commands.add_parser(name, help=summary)
+        command.add_argument("year")
+        command.add_argument("semester")
+        command.add_argument(
+            "stages", nargs="*", help="stages, all with criteria by default"
+        )
+        command.add_argument("--jobs", type=int)
+        if name == "export":
+            command.add_argument("--output")
+            command.add_argument("--format", choices=("csv", "json"), default="csv")
+        command.set_defaults(run=run)
+
+    args = parser.parse_args()
+    start = time.monotonic()
+    status = args.run(args)
+    print(f"Done in {time.monotonic() - start:.1f}s")
+
+    from csse3010_tools.giteaclient import client_stats
+
+    stats = client_stats()
+    if stats:
+        print(stats.summary())
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import json
+import os
+from dataclasses import asdict, dataclass
+from typing import TYPE_CHECKING, List, Optional
+
+from csse3010_tools.repostore import RepoStore
+from csse3010_tools.roster import Student
+
+if TYPE_CHECKING:
+    from gitea import Gitea
+
+# One file per student, newest commit first.
+COMMIT_CACHE_ROOT = os.path.join("temporary", "commits")
+
+# Commits requested per page when catching up with the API.
+COMMITS_PAGE_LIMIT = 50
+
+# Separators for parsing git log output, which can't appear in a message.
+_FIELD = "\x1f"
+_RECORD = "\x1e"
+
+
+@dataclass
+class CommitInfo:
+    date: str
+    hash: str
+    message: str
+    url: str
+
+
+def _cache_path(student_number: str) -> str:
+    return os.path.join(COMMIT_CACHE_ROOT, f"{student_number}.json")
+
+
+def load_commits(student_number: str) -> Optional[List[CommitInfo]]:
+    """
+    Returns the student's cached commits, or None if there are none cached.
+    """
+    path = _cache_path(student_number)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r") as f:
+            return [CommitInfo(**commit) for commit in json.load(f)]
+    except Exception as e:
+        print(f"Ignoring unreadable commit cache {path}: {e}")
+        return None
+
+
+def save_commits(student_number: str, commits: List[CommitInfo]) -> None:
+    os.makedirs(COMMIT_CACHE_ROOT, exist_ok=True)
+    path = _cache_path(student_number)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump([asdict(commit) for commit in commits], f)
+    os.replace(tmp_path, path)
+
+
+def commits_from_store(
+    store: RepoStore, student: Student, web_url: str
+) -> Optional[List[CommitInfo]]:
+    """
+    Lists the commits on the student's default branch from the repo store,
+    as of its last fetch. Returns None if the student isn't in the store.
+    """
+    from git.exc import GitCommandError
+
+    if not store.has_remote(student.username):
+        return None
+    try:
+        log = store.repo.git.log(
+            f"--format=%H{_FIELD}%cI{_FIELD}%B{_RECORD}",
+            store.default_ref(student.username),
+        )
+    except GitCommandError:
+        return None  # Never fetched, or an empty repository
+
+    commits = []
+    for record in log.split(_RECORD):
+        record = record.strip("\n")
+        if not record:
+            continue
+        sha, date, message = record.split(_FIELD, 2)
+        commits.append(
+            CommitInfo(
+                date=date,
+                hash=sha,
+                message=message,
+                url=f"{web_url}/{student.org}/repo/commit/{sha}",
+            )
+        )
+    return commits
+
+
+def commits_since(
+    gitea: "Gitea", student: Student, known: List[CommitInfo]
+) -> List[CommitInfo]:
+    """
+    Returns the student's commits from the API, newest first. Only pages up
+    to the newest known commit are requested, the rest come from known.
+    If that commit is gone (history was rewritten) everything is fetched.
+    """
+    from gitea.exceptions import ConflictException, NotFoundException
+
+    newest = known[0].hash if known else None
+    endpoint = f"/repos/{student.org}/repo/commits"
+    fetched: List[CommitInfo] = []
+    page = 1
+    while True:
+        params = {
+            "page": page,
+            "limit": COMMITS_PAGE_LIMIT,
+            "stat": "false",
+            "verification": "false",
+            "files": "false",
+        }
+        try:
+            commits = gitea.requests_get(endpoint, params=params)
+        except (ConflictException, NotFoundException):
+            return []  # Empty or missing repository
+        for commit in commits:
+            if commit["sha"] == newest:
+                return fetched + known
+            fetched.append(
+                CommitInfo(
+                    date=commit["created"],
+                    hash=commit["sha"],
+                    message=commit["commit"]["message"],
+                    url=commit["html_url"],
+                )
+            )
+        if len(commits) < COMMITS_PAGE_LIMIT:
+            return fetched
+        page += 1
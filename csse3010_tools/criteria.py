@@ -0,0 +1,149 @@
+import os
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+# Rubrics (and serde) are only imported once one is parsed, scanning
+# headers doesn't need them
+if TYPE_CHECKING:
+    from csse3010_tools.rubric import RubricTemplate
+
+CRITERIA_ROOT = os.path.join(".", "criteria")
+
+# The top level keys identifying a rubric, which come before its tasks.
+HEADER_KEYS = ("year", "sem", "name")
+
+# (year, sem, stage)
+CriteriaKey = Tuple[str, str, str]
+
+
+@dataclass(frozen=True)
+class CriteriaHeader:
+    year: str
+    sem: str
+    name: str
+    path: str
+
+    @property
+    def key(self) -> CriteriaKey:
+        return (self.year, self.sem, self.name)
+
+
+def _unquote(value: str) -> str:
+    value = value.split(" #", 1)[0].strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+        return value[1:-1]
+    return value
+
+
+def scan_header(path: str) -> Optional[CriteriaHeader]:
+    """
+    Reads just the year/sem/name lines at the top of a criteria file,
+    stopping at 'tasks:', without parsing the rest of the YAML.
+    Returns None if the file doesn't have all three.
+    """
+    found: Dict[str, str] = {}
+    with open(path, "r") as f:
+        for line in f:
+            if line.startswith("tasks:"):
+                break
+            if line[:1].isspace() or ":" not in line:
+                continue
+            key, _, value = line.partition(":")
+            if key in HEADER_KEYS:
+                found[key] = _unquote(value)
+            if len(found) == len(HEADER_KEYS):
+                break
+    if len(found) != len(HEADER_KEYS):
+        return None
+    return CriteriaHeader(found["year"], found["sem"], found["name"], path)
+
+
+class CriteriaIndex:
+    """
+    Index of the criteria files by (year, sem, stage).
+
+    scan only reads the header of each file, a rubric is parsed the first
+    time it is asked for and kept until its file changes, so startup doesn't
+    slow down as old rubrics pile up in criteria/.
+    """
+
+    def __init__(self, root: str = CRITERIA_ROOT):
+        self._root = root
+        self._lock = threading.Lock()
+        self._headers: Dict[CriteriaKey, CriteriaHeader] = {}
+        # path -> ((mtime, size), compiled rubric)
+        self._parsed: Dict[str, Tuple[Tuple[int, int], "RubricTemplate"]] = {}
+        self._years: List[str] = []
+        self._semesters: List[str] = []
+        self._stages: List[str] = []
+
+    def scan(
+        self, on_progress: Optional[Callable[[int, int, str], None]] = None
+    ) -> None:
+        """
+        Rebuilds the index from the headers of every .yaml file under root.
+        """
+        paths = []
+        for dirpath, _, files in os.walk(self._root):
+            paths += [os.path.join(dirpath, f) for f in files if f.endswith(".yaml")]
+        paths.sort()
+
+        headers: Dict[CriteriaKey, CriteriaHeader] = {}
+        for i, path in enumerate(paths):
+            try:
+                header = scan_header(path)
+                if header is None:
+                    print(f"No year/sem/name in criteria {path}")
+                elif header.key in headers:
+                    print(f"Criteria {path} duplicates {headers[header.key].path}")
+                else:
+                    headers[header.key] = header
+            except Exception as e:
+                print(f"Failed to read criteria {path}: {e}")
+            if on_progress:
+                on_progress(i + 1, len(paths), path)
+
+        with self._lock:
+            self._headers = headers
+            self._years = sorted({h.year for h in headers.values()})
+            self._semesters = sorted({h.sem for h in headers.values()})
+            self._stages = sorted({h.name for h in headers.values()})
+
+    def years(self) -> List[str]:
+        return self._years
+
+    def semesters(self) -> List[str]:
+        return self._semesters
+
+    def stages(self) -> List[str]:
+        return self._stages
+
+    def get(self, year: str, semester: str, stage: str) -> "RubricTemplate":
+        """
+        Returns the compiled rubric for the given year, semester and stage.
+        Raises FileNotFoundError if there is none.
+        """
+        header = self._headers.get((year, semester, stage))
+        if header is None:
+            raise FileNotFoundError(
+                f"No matching criteria found for {year=}, {semester=}, {stage=}"
+            )
+
+        st = os.stat(header.path)
+        version = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            cached = self._parsed.get(header.path)
+            if cached and cached[0] == version:
+                return cached[1]
+
+        try:
+            from csse3010_tools.rubric import RubricTemplate
+
+            template = RubricTemplate.from_file(header.path)
+        except Exception as e:
+            print(f"Failed to parse criteria {header.path}: {e}")
+            raise FileNotFoundError(f"Criteria {header.path} is invalid") from e
+        with self._lock:
+            self._parsed[header.path] = (version, template)
+        return template
@@ -0,0 +1,255 @@
+import argparse
+import csv
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from csse3010_tools.build import normalize_stage_dir
+from csse3010_tools.criteria import CriteriaIndex
+from csse3010_tools.marksindex import MarksIndex
+from csse3010_tools.rubric import RubricTemplate
+
+EXPORT_ROOT = os.path.join("temporary", "export")
+
+EXPORT_JOBS = os.cpu_count() or 4
+
+# Files handed to a worker process at a time.
+EXPORT_CHUNK_SIZE = 32
+
+# Set in each worker process by _init_worker, so templates are compiled
+# once per process rather than once per file.
+_worker_templates: Dict[str, RubricTemplate] = {}
+
+
+@dataclass
+class StageTable:
+    """
+    The marks of every student for one stage, column by column.
+    Columns are the students, each band's choice ('<task>.<band>'), each
+    task's average ('<task>') and the total.
+    """
+
+    stage: str
+    columns: Dict[str, list] = field(default_factory=dict)
+    # Files that could not be parsed (fully), with why
+    errors: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def rows(self) -> int:
+        return len(self.columns.get("student", []))
+
+
+def marks_directory(year: str, semester: str) -> str:
+    return os.path.join("temporary", f"marks_sem{semester}_{year}")
+
+
+def _init_worker(yamls: Dict[str, str]) -> None:
+    global _worker_templates
+    _worker_templates = {
+        stage: RubricTemplate.from_yaml(yaml) for stage, yaml in yamls.items()
+    }
+
+
+def _parse_marks(
+    stage: str, path: str
+) -> Tuple[Optional[List[int]], Optional[List[str]], str]:
+    """
+    Parses one marks file in a worker, returning its choices and comments
+    in template order, and any problems found with it.
+    """
+    template = _worker_templates[stage]
+    try:
+        with open(path, "r") as f:
+            marks, diagnostics = template.parse_md(f.read())
+        return marks.choices, marks.comments, "; ".join(map(str, diagnostics))
+    except Exception as e:
+        return None, None, str(e)
+
+
+def collect_marks(
+    index: MarksIndex,
+    templates: Dict[str, RubricTemplate],
+    jobs: int = EXPORT_JOBS,
+) -> Dict[str, StageTable]:
+    """
+    Parses every student's marks for the given stages (stage directory
+    name -> template) in a process pool, and returns a table per stage.
+    """
+    files = [
+        (stage, student, path)
+        for stage in templates
+        for student, _, path in index.all_marks(stage)
+    ]
+    yamls = {stage: template.yaml for stage, template in templates.items()}
+
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=_init_worker, initargs=(yamls,)
+    ) as pool:
+        parsed = pool.map(
+            _parse_marks,
+            [stage for stage, _, _ in files],
+            [path for _, _, path in files],
+            chunksize=EXPORT_CHUNK_SIZE,
+        )
+        results = list(zip(files, parsed))
+
+    tables = {}
+    for stage, template in templates.items():
+        table = StageTable(stage)
+        table.columns["student"] = []
+        for task, band in template.slots:
+            table.columns[f"{task}.{band}"] = []
+        for task in template.task_names:
+            table.columns[task] = []
+        table.columns["total"] = []
+        tables[stage] = table
+
+    for (stage, student, path), (choices, comments, error) in results:
+        table = tables[stage]
+        template = templates[stage]
+        if error:
+            table.errors[path] = error
+        if choices is None:
+            continue
+        table.columns["student"].append(student)
+        per_task: Dict[str, List[int]] = {task: [] for task in template.task_names}
+        for (task, band), choice in zip(template.slots, choices):
+            table.columns[f"{task}.{band}"].append(choice)
+            per_task[task].append(choice)
+        total = 0.0
+        for task, task_choices in per_task.items():
+            average = sum(task_choices) / len(task_choices) if task_choices else 0.0
+            table.columns[task].append(average)
+            total += average
+        table.columns["total"].append(total)
+    return tables
+
+
+def summarise(table: StageTable) -> Dict[str, Dict[str, float]]:
+    """
+    Distribution statistics of every numeric column of a table, plus a
+    histogram of the choices made in each band.
+    """
+    stats: Dict[str, Dict[str, float]] = {}
+    for name, values in table.columns.items():
+        if name == "student" or not values:
+            continue
+        stats[name] = {
+            "count": len(values),
+            "mean": statistics.fmean(values),
+            "stdev": statistics.pstdev(values),
+            "min": min(values),
+            "median": statistics.median(values),
+            "max": max(values),
+        }
+        if "." in name:
+            for value in values:
+                key = f"={value}"
+                stats[name][key] = stats[name].get(key, 0) + 1
+    return stats
+
+
+def write_csv(table: StageTable, path: str) -> None:
+    names = list(table.columns)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(names)
+        writer.writerows(zip(*(table.columns[name] for name in names)))
+
+
+def write_json(table: StageTable, path: str) -> None:
+    """
+    Writes the table column by column, ready for pandas.DataFrame(data).
+    """
+    with open(path, "w") as f:
+        json.dump(table.columns, f)
+
+
+def stage_templates(
+    criteria: CriteriaIndex,
+    year: str,
+    semester: str,
+    stages: Optional[List[str]] = None,
+) -> Tuple[Dict[str, RubricTemplate], List[str]]:
+    """
+    Returns stage directory -> template for the given stages (all that have
+    criteria, by default), and the given stages that have no criteria.
+    """
+    templates = {}
+    missing = []
+    for stage in stages or criteria.stages():
+        try:
+            template = criteria.get(year, semester, stage)
+        except FileNotFoundError:
+            if stages:
+                print(f"No criteria for {year} semester {semester} {stage}")
+                missing.append(stage)
+            continue
+        templates[normalize_stage_dir(stage)] = template
+    return templates, missing
+
+
+def export_marks(
+    year: str,
+    semester: str,
+    stages: Optional[List[str]] = None,
+    output: str = EXPORT_ROOT,
+    fmt: str = "csv",
+    jobs: int = EXPORT_JOBS,
+) -> Dict[str, StageTable]:
+    """
+    Exports every student's marks for the semester's stages (all that have
+    criteria, by default) to <output>/<stage>.<fmt>, along with
+    <stage>-stats.json.
+    """
+    criteria = CriteriaIndex()
+    criteria.scan()
+    index = MarksIndex(marks_directory(year, semester))
+    index.refresh()
+
+    templates, _ = stage_templates(criteria, year, semester, stages)
+    tables = collect_marks(index, templates, jobs)
+
+    os.makedirs(output, exist_ok=True)
+    for stage, table in tables.items():
+        path = os.path.join(output, f"{stage}.{fmt}")
+        if fmt == "csv":
+            write_csv(table, path)
+        else:
+            write_json(table, path)
+        with open(os.path.join(output, f"{stage}-stats.json"), "w") as f:
+            json.dump(summarise(table), f, indent=1)
+        for error_path, error in table.errors.items():
+            print(f"{error_path}: {error}")
+        print(f"{stage}: {table.rows} students written to {path}")
+    return tables
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export every student's marks from the marks repo."
+    )
+    parser.add_argument("year")
+    parser.add_argument("semester")
+    parser.add_argument(
+        "stages", nargs="*", help="stages to export, all with criteria by default"
+    )
+    parser.add_argument("--output", default=EXPORT_ROOT)
+    parser.add_argument("--format", choices=("csv", "json"), default="csv")
+    parser.add_argument("--jobs", type=int, default=EXPORT_JOBS)
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    tables = export_marks(
+        args.year, args.semester, args.stages, args.output, args.format, args.jobs
+    )
+    rows = sum(table.rows for table in tables.values())
+    print(f"Exported {rows} marks files in {time.monotonic() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
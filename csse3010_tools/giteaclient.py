@@ -0,0 +1,305 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, List, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:
+    import requests
+    from gitea import Gitea
+
+TOKEN_PATH = ".access_token"
+
+# Point this at a local stub server to test without the real Gitea.
+GITEA_URL = os.environ.get("GITEA_URL", "https://csse3010-gitea.uqcloud.net")
+
+# One file per GET request (url, parameters and token).
+GITEA_CACHE_ROOT = os.path.join("temporary", "gitea_cache")
+
+# A cached response younger than this is used without asking Gitea at all,
+# older ones are revalidated with If-None-Match/If-Modified-Since. Commits
+# and the like can change at any moment, so by default always revalidate.
+GITEA_CACHE_MAX_AGE = 0
+
+# Endpoints that rarely change, (path pattern, max age). Which orgs a
+# student is in and which repos an org has are set up once a semester.
+GITEA_CACHE_MAX_AGES = (
+    (r"/users/[^/]+/orgs$", 60 * 60),
+    (r"/orgs/[^/]+/repos$", 60 * 60),
+)
+
+# Once the cache is bigger than this the least recently used responses
+# are removed, down to three quarters of it.
+GITEA_CACHE_BUDGET = 256 * 1024**2
+
+# Requests in flight at once, across every thread sharing the client.
+# Also the number of keep-alive connections kept open.
+GITEA_MAX_REQUESTS = 16
+
+
+@dataclass
+class GiteaStats:
+    requests: int = 0
+    # Answered from the cache without a request
+    cached: int = 0
+    # Revalidated with a 304, the body came from the cache
+    not_modified: int = 0
+    errors: int = 0
+    # Total time spent waiting on Gitea, in seconds
+    latency: float = 0.0
+
+    @property
+    def sent(self) -> int:
+        return self.requests - self.cached
+
+    def summary(self) -> str:
+        average = self.latency / self.sent * 1000 if self.sent else 0.0
+        return (
+            f"{self.requests} Gitea requests: {self.cached} cached, "
+            f"{self.not_modified} not modified, {self.errors} failed, "
+            f"{average:.0f}ms average"
+        )
+
+
+class GiteaSession:
+    """
+    Stands in for the requests.Session of a Gitea client: keeps its
+    connections alive in a pool, limits how many requests are in flight,
+    counts requests and their latency, and caches GET responses on disk.
+
+    Cached responses are revalidated with the ETag/Last-Modified Gitea sent,
+    so an unchanged resource costs a 304 rather than the whole body. Those
+    matching max_ages (otherwise max_age) are reused outright while younger
+    than that. The cache is kept under cache_budget bytes.
+    """
+
+    def __init__(
+        self,
+        session: "requests.Session",
+        max_requests: int = GITEA_MAX_REQUESTS,
+        cache_root: Optional[str] = GITEA_CACHE_ROOT,
+        max_age: float = GITEA_CACHE_MAX_AGE,
+        max_ages: Sequence[Tuple[str, float]] = GITEA_CACHE_MAX_AGES,
+        cache_budget: int = GITEA_CACHE_BUDGET,
+    ):
+        from requests.adapters import HTTPAdapter
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_requests)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        self._session = session
+        self._limit = threading.BoundedSemaphore(max_requests)
+        self._cache_root = cache_root
+        self._max_age = max_age
+        self._max_ages = [(re.compile(pattern), age) for pattern, age in max_ages]
+        self._cache_budget = cache_budget
+        # Bytes in the cache, counted on the first save
+        self._cache_size: Optional[int] = None
+        self._cache_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = GiteaStats()
+
+    def __getattr__(self, name: str) -> Any:
+        # auth, verify, proxies... as set up by the Gitea client
+        return getattr(self._session, name)
+
+    def get(self, url: str, params=None, headers=None, **kwargs) -> "requests.Response":
+        params = dict(params or {})
+        headers = dict(headers or {})
+        path = self._cache_path(url, params, headers)
+        entry = self._load(path)
+        if entry and time.time() - entry["fetched_at"] < self._max_age_for(url):
+            self._count(cached=1)
+            try:
+                os.utime(path)  # Recently used, as far as pruning goes
+            except FileNotFoundError:
+                pass  # Pruned meanwhile
+            return self._cached_response(entry, url)
+
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        response = self._send("get", url, params=params, headers=headers, **kwargs)
+
+        if response.status_code == 304 and entry:
+            self._count(requests=0, not_modified=1)
+            entry["fetched_at"] = time.time()
+            self._save(path, entry)
+            return self._cached_response(entry, url)
+        if response.status_code == 200:
+            self._save(
+                path,
+                {
+                    "url": response.url,
+                    "fetched_at": time.time(),
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "headers": dict(response.headers),
+                    "body": response.text,
+                },
+            )
+        return response
+
+    def post(self, url: str, **kwargs) -> "requests.Response":
+        return self._send("post", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> "requests.Response":
+        return self._send("put", url, **kwargs)
+
+    def patch(self, url: str, **kwargs) -> "requests.Response":
+        return self._send("patch", url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> "requests.Response":
+        return self._send("delete", url, **kwargs)
+
+    def _send(self, method: str, url: str, **kwargs) -> "requests.Response":
+        with self._limit:
+            start = time.perf_counter()
+            try:
+                response = self._session.request(method, url, **kwargs)
+            except Exception:
+                self._count(errors=1, latency=time.perf_counter() - start)
+                raise
+        failed = response.status_code >= 400
+        self._count(errors=int(failed), latency=time.perf_counter() - start)
+        return response
+
+    def _count(
+        self,
+        requests: int = 1,
+        cached: int = 0,
+        not_modified: int = 0,
+        errors: int = 0,
+        latency: float = 0.0,
+    ) -> None:
+        with self._stats_lock:
+            self.stats.requests += requests
+            self.stats.cached += cached
+            self.stats.not_modified += not_modified
+            self.stats.errors += errors
+            self.stats.latency += latency
+
+    def _cache_path(self, url: str, params: dict, headers: dict) -> Optional[str]:
+        if not self._cache_root:
+            return None
+        # Different tokens can see different things
+        key = json.dumps(
+            [url, sorted(params.items()), headers.get("Authorization")], default=str
+        )
+        digest = hashlib.sha1(key.encode("utf8")).hexdigest()
+        return os.path.join(self._cache_root, digest[:2], f"{digest}.json")
+
+    def _max_age_for(self, url: str) -> float:
+        path = url.split("?", 1)[0]
+        for pattern, age in self._max_ages:
+            if pattern.search(path):
+                return age
+        return self._max_age
+
+    def _load(self, path: Optional[str]) -> Optional[dict]:
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except Exception:
+            return None  # Half written or from an older version, refetch
+
+    def _save(self, path: Optional[str], entry: dict) -> None:
+        if not path:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f)
+        size = os.path.getsize(tmp_path)
+        replaced = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+
+        with self._cache_lock:
+            if self._cache_size is None:
+                self._cache_size = sum(size for _, _, size in self._cache_entries())
+            else:
+                self._cache_size += size - replaced
+            if self._cache_size > self._cache_budget:
+                self._prune()
+
+    def _cache_entries(self) -> List[Tuple[float, str, int]]:
+        """
+        (last used, path, size) of every cached response.
+        """
+        entries = []
+        for directory, _, files in os.walk(self._cache_root):
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+        return entries
+
+    def _prune(self) -> None:
+        """
+        Removes least recently used responses until the cache is down to
+        three quarters of its budget. Called with _cache_lock held.
+        """
+        entries = sorted(self._cache_entries())
+        total = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if total <= self._cache_budget * 3 // 4:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._cache_size = total
+
+    def _cached_response(self, entry: dict, url: str) -> "requests.Response":
+        from requests import Response
+        from requests.structures import CaseInsensitiveDict
+
+        response = Response()
+        response.status_code = 200
+        response.url = entry.get("url") or url
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.encoding = "utf-8"
+        response._content = entry["body"].encode("utf-8")
+        return response
+
+
+_client: Optional["Gitea"] = None
+_client_lock = threading.Lock()
+
+
+def read_token(path: str = TOKEN_PATH) -> str:
+    with open(path) as file:
+        return file.read().strip()
+
+
+def get_client(token: Optional[str] = None) -> "Gitea":
+    """
+    The Gitea client shared by everything in this process, created (and
+    gitea imported) on first use. The token is read from TOKEN_PATH if
+    not given.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            from gitea import Gitea
+
+            _client = Gitea(GITEA_URL, token or read_token())
+            _client.requests = GiteaSession(_client.requests)
+        return _client
+
+
+def client_stats() -> Optional[GiteaStats]:
+    """
+    The shared client's request counters, None if it hasn't been created.
+    """
+    return _client.requests.stats if _client else None
@@ -1,12 +1,37 @@
 import os
+import argparse
 import datetime
 import json
-from gitea import Gitea, User, Repository
-from serde.json import to_json
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, TypeVar
 
-token_path = ".access_token"
-gitea_url = "https://csse3010-gitea.uqcloud.net"
+from csse3010_tools.giteaclient import client_stats, get_client
+from csse3010_tools.repostore import STORE_PATH, RepoStore
+from csse3010_tools.roster import Student, get_roster, is_student_username, load_roster
+
+if TYPE_CHECKING:
+    from gitea import Gitea
+
+NO_COMMITS = "No commits found"
+
+# Concurrent requests made against Gitea while resolving commits.
+RESOLVER_WORKERS = 16
+
+# Commits requested per page, only the first page is normally needed.
+COMMITS_PAGE_LIMIT = 20
+
+RETRY_ATTEMPTS = 4
+RETRY_BASE_DELAY = 0.5
+
+# Which timestamp decides whether a commit made the deadline when resolving
+# from the local repo store:
+# - committer: the committer date recorded in the commit (what the API uses)
+# - author: the author date recorded in the commit
+# - push: when the commit was first seen on the remote, from the reflog of
+#   the remote-tracking branch. Only as accurate as how often we fetch.
+TIME_POLICIES = ("committer", "author", "push")
 
 design_tasks = {
     "s1": datetime.datetime(
@@ -24,29 +49,24 @@ design_tasks = {
     # ),
 }
 
-
-def get_gitea_client():
-    with open(token_path) as file:
-        token = file.read().strip()
-    return Gitea(gitea_url, token)
+T = TypeVar("T")
 
 
-def is_student_user(username: str) -> bool:
-    return username.startswith("s") and username[1:].isdigit()
+def get_gitea_client() -> "Gitea":
+    return get_client()
 
 
-def get_student_repos(gitea: Gitea, task_key: str):
-    students = {}
-    users = gitea.get_users()
-    for user in users:
-        if is_student_user(user.username):
-            for org in user.get_orgs():
-                if user.username[1:] in org.name:
-                    for repo in org.get_repositories():
-                        if repo.name == "repo":
-                            students[user.username] = repo
-                            print(f"{user.username}: {students[user.username].name}")
-    return students
+def get_student_repos(gitea: "Gitea") -> Dict[str, Student]:
+    """
+    Returns every student with a known 'repo' repository, using the
+    (concurrently fetched, cached) roster.
+    """
+    roster = get_roster(gitea)
+    return {
+        username: student
+        for username, student in roster.students.items()
+        if student.has_repo
+    }
 
 
 def load_existing_commits(filename="latest_commits.json"):
@@ -56,38 +76,236 @@ def load_existing_commits(filename="latest_commits.json"):
     return {}
 
 
-def get_latest_commits(students, deadline, existing_commits, current_task: str):
-    latest_commits = existing_commits.get(current_task, {})
+def with_retry(
+    func: Callable[[], T],
+    attempts: int = RETRY_ATTEMPTS,
+    base_delay: float = RETRY_BASE_DELAY,
+) -> T:
+    """
+    Calls func, retrying with exponential backoff if it raises.
+    Missing or empty repositories are not retried.
+    """
+    from gitea.exceptions import ConflictException, NotFoundException
 
-    for student, repo in students.items():
-        if student in latest_commits and latest_commits[student] != "No commits found":
-            continue  # Skip API call if we already have a commit
+    for attempt in range(attempts):
+        try:
+            return func()
+        except (ConflictException, NotFoundException):
+            raise
+        except Exception as e:
+            if attempt == attempts - 1:
+                raise
+            delay = base_delay * (2**attempt)
+            print(f"Request failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
 
-        print("\n---")
 
-        commits = repo.get_commits()
-        latest_commit = None
-        latest = None
+def find_commit_before(
+    gitea: "Gitea", student: Student, deadline: datetime.datetime
+) -> Optional[str]:
+    """
+    Returns the sha of the newest commit made at or before the deadline.
+
+    Gitea is asked only for commits up to the deadline, and paging stops at
+    the first page that contains one. Commits come back newest first, so the
+    date filter is only a safety net for servers that ignore 'until'.
+    """
+    from gitea.exceptions import ConflictException
+
+    endpoint = f"/repos/{student.org}/repo/commits"
+    page = 1
+    while True:
+        params = {
+            "until": deadline.isoformat(),
+            "page": page,
+            "limit": COMMITS_PAGE_LIMIT,
+            "stat": "false",
+            "verification": "false",
+            "files": "false",
+        }
+        try:
+            commits = with_retry(lambda: gitea.requests_get(endpoint, params=params))
+        except ConflictException:
+            return None  # Empty repository
+        if not commits:
+            return None
 
+        latest = None
+        latest_commit = None
         for commit in commits:
-            commit_date = datetime.datetime.strptime(
-                commit.created, "%Y-%m-%dT%H:%M:%S%z"
-            ).astimezone(datetime.timezone(datetime.timedelta(hours=10)))
-            print("Deadline:", deadline)
-            print("Commit Date:", commit_date)
-            if commit_date <= deadline and (latest is None or commit_date >= latest):
+            commit_date = datetime.datetime.fromisoformat(commit["created"])
+            if commit_date <= deadline and (latest is None or commit_date > latest):
                 latest = commit_date
-                latest_commit = commit.sha
-            # else:
-            #     if commit_date >= deadline:
-            #         print("Found a commit past the deadline, ignoring it")
-            #     break
-            print(latest_commit)
+                latest_commit = commit["sha"]
+        if latest_commit:
+            return latest_commit
+        page += 1
+
+
+def resolve_student(
+    gitea: "Gitea", student: Student, deadlines: Dict[str, datetime.datetime]
+) -> Dict[str, str]:
+    """
+    Resolves the deadline commit for each of the given tasks for one student.
+    """
+    resolved = {}
+    for task, deadline in deadlines.items():
+        try:
+            sha = find_commit_before(gitea, student, deadline)
+        except Exception as e:
+            print(f"{student.username} ({task}): failed to fetch commits: {e}")
+            continue
+        resolved[task] = sha if sha else NO_COMMITS
+    return resolved
+
+
+def get_latest_commits(
+    gitea: "Gitea",
+    students: Dict[str, Student],
+    deadlines: Dict[str, datetime.datetime],
+    existing_commits: Dict[str, Dict[str, str]],
+    workers: int = RESOLVER_WORKERS,
+    failed: Optional[List[str]] = None,
+) -> Dict[str, Dict[str, str]]:
+    """
+    Resolves the deadline commit of every task in deadlines for every
+    student, in a single concurrent pass over the roster.
+    Tasks that already have a commit for a student are not asked for again.
+    Students any task couldn't be resolved for are added to failed.
+    """
+    for task in deadlines:
+        existing_commits.setdefault(task, {})
 
-        latest_commits[student] = latest_commit if latest_commit else "No commits found"
-        print(latest_commits[student])
+    pending = {}
+    for student in students:
+        missing = {
+            task: deadline
+            for task, deadline in deadlines.items()
+            if existing_commits[task].get(student, NO_COMMITS) == NO_COMMITS
+        }
+        if missing:
+            pending[student] = missing
 
-    return latest_commits
+    print(f"Resolving commits for {len(pending)}/{len(students)} students")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(resolve_student, gitea, students[student], missing): student
+            for student, missing in pending.items()
+        }
+        for future in as_completed(futures):
+            student = futures[future]
+            resolved = future.result()
+            for task, sha in resolved.items():
+                existing_commits[task][student] = sha
+                print(f"{student} ({task}): {sha}")
+            if failed is not None and len(resolved) < len(pending[student]):
+                failed.append(student)
+
+    return existing_commits
+
+
+def list_local_students(store: RepoStore) -> Dict[str, Optional[Student]]:
+    """
+    Returns every student that is already in the repo store or has a repo in
+    the cached roster. Never touches the network, so it works offline.
+    """
+    students: Dict[str, Optional[Student]] = {
+        remote.name: None
+        for remote in store.repo.remotes
+        if is_student_username(remote.name)
+    }
+    roster = load_roster()
+    if roster:
+        for username, student in roster.students.items():
+            if student.has_repo:
+                students[username] = student
+    return students
+
+
+def _sync_student(store: RepoStore, student: str, info: Optional[Student]) -> bool:
+    try:
+        with_retry(lambda: store.fetch(student, info.ssh_url if info else None))
+        return True
+    except Exception as e:
+        print(f"{student}: could not fetch into the repo store: {e}")
+        return False
+
+
+def sync_local_store(
+    store: RepoStore,
+    students: Dict[str, Optional[Student]],
+    workers: int = RESOLVER_WORKERS,
+) -> List[str]:
+    """
+    Fetches every student's repo into the store concurrently.
+    Returns the students that are now in the store.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(_sync_student, store, student, info): student
+            for student, info in students.items()
+        }
+        return [futures[f] for f in as_completed(futures) if f.result()]
+
+
+def find_local_commit_before(
+    store: RepoStore,
+    student: str,
+    deadline: datetime.datetime,
+    policy: str = "committer",
+) -> Optional[str]:
+    """
+    Returns the sha of the newest commit on the student's default branch
+    that made the deadline under the given time policy, using only the
+    local repo store.
+    """
+    if policy not in TIME_POLICIES:
+        raise ValueError(f"Unknown time policy {policy}")
+    from git.exc import GitCommandError
+
+    ref = store.default_ref(student)
+    timestamp = int(deadline.timestamp())
+    try:
+        if policy == "committer":
+            sha = store.repo.git.rev_list("-1", f"--before={timestamp}", ref)
+            return sha or None
+        if policy == "author":
+            log = store.repo.git.log("--format=%H %at", ref)
+        else:
+            log = store.repo.git.reflog("show", "--format=%H %gd", "--date=unix", ref)
+    except GitCommandError:
+        return None  # Empty repository or never fetched
+
+    latest = None
+    latest_commit = None
+    for line in log.splitlines():
+        sha, _, when = line.partition(" ")
+        # %gd looks like refs/remotes/s1234567/HEAD@{1742176800}
+        when = int(when.rsplit("{", 1)[-1].rstrip("}"))
+        if when <= timestamp and (latest is None or when > latest):
+            latest = when
+            latest_commit = sha
+    return latest_commit
+
+
+def get_latest_local_commits(
+    store: RepoStore,
+    students: List[str],
+    deadlines: Dict[str, datetime.datetime],
+    existing_commits: Dict[str, Dict[str, str]],
+    policy: str = "committer",
+) -> Dict[str, Dict[str, str]]:
+    """
+    Like get_latest_commits, but resolves every task from the repo store.
+    Local lookups are cheap, so all tasks are always re-resolved.
+    """
+    for task, deadline in deadlines.items():
+        task_commits = existing_commits.setdefault(task, {})
+        for student in sorted(students):
+            sha = find_local_commit_before(store, student, deadline, policy)
+            task_commits[student] = sha if sha else NO_COMMITS
+            print(f"{student} ({task}): {task_commits[student]}")
+    return existing_commits
 
 
 def save_commits_to_json(commits, filename="latest_commits.json"):
@@ -96,35 +314,87 @@ def save_commits_to_json(commits, filename="latest_commits.json"):
     print(f"Saved commit data to {filename}")
 
 
-def main(task_name):
-    if task_name not in design_tasks:
-        print(f"Task {task_name} not found.")
-        return
-
-    gitea = get_gitea_client()
-    deadline = design_tasks[task_name]
+def main(
+    task_names: List[str],
+    local: bool = False,
+    fetch: bool = True,
+    policy: str = "committer",
+) -> int:
+    """
+    Resolves and saves the deadline commits of the given tasks (all, if
+    none are given). Returns non-zero for an unknown task or if any
+    student's commits couldn't be resolved.
+    """
+    for task_name in task_names:
+        if task_name not in design_tasks:
+            print(f"Task {task_name} not found.")
+            return 1
+    deadlines = {task: design_tasks[task] for task in task_names or design_tasks}
 
     print("Loading existing data")
     existing_commits = load_existing_commits()
-    if task_name not in existing_commits:
-        existing_commits[task_name] = {}
-
-    print("Getting student repos")
-    student_repos = get_student_repos(gitea, task_name)
-    print(student_repos)
-    print("Getting latest commits")
-    commits = get_latest_commits(student_repos, deadline, existing_commits, task_name)
-    existing_commits[task_name] = commits
-    print(existing_commits)
 
-    save_commits_to_json(existing_commits)
+    failed: List[str] = []
+    if local:
+        store = RepoStore()
+        students = list_local_students(store)
+        if fetch:
+            print(f"Fetching {len(students)} repos into the store")
+            fetched = sync_local_store(store, students)
+            failed = sorted(set(students) - set(fetched))
+        else:
+            fetched = [s for s in students if store.has_remote(s)]
+        print("Getting latest commits from the repo store")
+        commits = get_latest_local_commits(
+            store, fetched, deadlines, existing_commits, policy
+        )
+    else:
+        gitea = get_gitea_client()
+        print("Getting student repos")
+        student_repos = get_student_repos(gitea)
+        print("Getting latest commits")
+        commits = get_latest_commits(
+            gitea, student_repos, deadlines, existing_commits, failed=failed
+        )
 
-    for student, commit in commits.items():
-        print(f"{student}: {commit}")
+    save_commits_to_json(commits)
+    if failed:
+        print(f"Failed for {len(failed)} students: {', '.join(sorted(failed))}")
+        return 1
+    return 0
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python script.py <task_name>")
-    else:
-        main(sys.argv[1])
+    parser = argparse.ArgumentParser(
+        description="Find each student's last commit before a task's deadline."
+    )
+    parser.add_argument(
+        "tasks", nargs="+", help="task names from design_tasks, or 'all'"
+    )
+    parser.add_argument(
+        "--local",
+        action="store_true",
+        help=f"resolve from the repo store in {STORE_PATH} instead of the Gitea API",
+    )
+    parser.add_argument(
+        "--no-fetch",
+        action="store_true",
+        help="with --local, use the store as it is (works offline)",
+    )
+    parser.add_argument(
+        "--policy",
+        choices=TIME_POLICIES,
+        default="committer",
+        help="with --local, which timestamp decides if a commit made the deadline",
+    )
+    args = parser.parse_args()
+    status = main(
+        [] if args.tasks == ["all"] else args.tasks,
+        local=args.local,
+        fetch=not args.no_fetch,
+        policy=args.policy,
+    )
+    stats = client_stats()
+    if stats:
+        print(stats.summary())
+    sys.exit(status)
@@ -1,6 +1,11 @@
+# First, so --profile-startup can time everything else being imported
+from csse3010_tools.startup import STARTUP
+
+import argparse
 import os
 from typing import Optional
 from textual import on, work
+from textual.worker import get_current_worker
 from textual.app import App, ComposeResult
 from textual.containers import Vertical, Container
 from textual.reactive import reactive
@@ -17,8 +22,10 @@ from textual.widgets import (
 )
 from subprocess import PIPE, Popen, STDOUT
 
-from csse3010_tools.appstate import AppState
+from csse3010_tools.appstate import AppState, WarmUpProgress
+from csse3010_tools.build import BuildKey, BuildResult, build_dir, sandbox_env
 from csse3010_tools.ui.banner import Banner
+from csse3010_tools.ui.build_log import BuildLog
 from csse3010_tools.ui.build_menu import BuildMenu, BuildCommand
 from csse3010_tools.ui.commit_hash_select import CommitHashSelect
 from csse3010_tools.ui.criteria_select import CriteriaSelect
@@ -60,6 +67,7 @@ class MarkingApp(App):
         ("ctrl+d", "deploy", "Deploy"),
         ("ctrl+c", "clean", "Clean"),
         ("ctrl+r", "reset", "Reset"),
+        ("ctrl+g", "sync_marks", "Sync Marks"),
     ]
 
     app_state: AppState
@@ -74,26 +82,76 @@ class MarkingApp(App):
         """Initialize the UI after the app mounts."""
         # self.theme = "tokyo-night"
 
-        # Populate the student selector with known student numbers
-        student_number_widget: StudentNumber = self.query_one(StudentNumber)
-        student_number_widget.data_bind(
-            student_numbers=self.app_state.list_student_numbers()
-        )
+        # Populate the student selector with whatever the roster cache had
+        self._update_student_numbers()
 
         # Build/Run menu initially disabled until a commit hash is chosen
         self.query_one("#buildmenu").disabled = True
 
-        # Populate the year/semester/stage dropdowns from AppState
-        self.query_one("#stage_select", Select).set_options(
-            [(stage, stage) for stage in self.app_state.get_stages()]
-        )
-        self.query_one("#year_select", Select).set_options(
-            [(year, year) for year in self.app_state.get_years()]
-        )
-        self.query_one("#semester_select", Select).set_options(
-            [(sem, sem) for sem in self.app_state.get_semesters()]
+        # Another marker's changes merged into the rubric by AppState
+        self.app_state.on_marks_merged(self._on_marks_merged)
+        # A student's repo that had to be fetched has been checked out
+        self.app_state.on_checked_out(self._update_prebuild_status)
+
+        self.call_after_refresh(STARTUP.end, "first paint")
+
+        # Criteria and an up to date roster arrive from the warm up worker
+        self._warm_up()
+
+    def on_unmount(self) -> None:
+        """Stop AppState's background work when the app exits."""
+        self.app_state.shutdown()
+
+    @work(exclusive=True, thread=True, group="warm_up")
+    def _warm_up(self) -> None:
+        """Runs AppState's warm up phase off the event loop."""
+        self.app_state.warm_up(
+            lambda progress: self.call_from_thread(self._on_warm_up_progress, progress)
         )
 
+    def _on_warm_up_progress(self, progress: WarmUpProgress) -> None:
+        """Streams the results of the warm up phase into the UI."""
+        banner = self.query_one(Banner)
+        if progress.phase == "criteria":
+            banner.progress = f"Criteria {progress.done}/{progress.total}"
+            self._update_criteria_options()
+        elif progress.phase == "students":
+            banner.progress = f"{progress.message} ({progress.done}/{progress.total})"
+            if progress.students:
+                self.app_state.add_students(progress.students)
+            if progress.students or progress.finished:
+                self._update_student_numbers()
+        elif progress.phase == "gitea":
+            banner.progress = ""
+            banner.version = self.app_state.gitea_version or "gitea version unknown"
+            banner.user = self.app_state.gitea_user or "gitea user unknown"
+            if STARTUP.enabled:
+                self.notify(message=STARTUP.report(), title="Startup", timeout=30)
+
+    def _update_student_numbers(self) -> None:
+        """Pushes the known student numbers into the student selector."""
+        student_number_widget: StudentNumber = self.query_one(StudentNumber)
+        student_number_widget.student_numbers = self.app_state.list_student_numbers()
+
+    def _update_criteria_options(self) -> None:
+        """
+        Populate the year/semester/stage dropdowns from AppState,
+        keeping any selection that is still valid.
+        """
+        for select_id, values in (
+            ("#stage_select", self.app_state.get_stages()),
+            ("#year_select", self.app_state.get_years()),
+            ("#semester_select", self.app_state.get_semesters()),
+        ):
+            select = self.query_one(select_id, Select)
+            options = [(value, value) for value in values]
+            if options == select._options[1:]:
+                continue
+            selected = select.value
+            select.set_options(options)
+            if selected in values:
+                select.value = selected
+
     def compose(self) -> ComposeResult:
         """Compose the primary layout."""
         yield Header()
@@ -116,17 +174,11 @@ class MarkingApp(App):
 
             self.app_state.refresh_current_hash()
 
-            commit_hash_dropdown = self.query_one("#commit-hash-dropdown", Select)
-            commits = self.app_state.list_commits(self.app_state.student_number)
-            commit_hash_dropdown.set_options(
-                [
-                    (f"{commit.hash[:16]}\n{commit.date}", commit.hash)
-                    for commit in commits
-                ]
-            )
-            commit_hash_dropdown.clear()
-
+            # Show the cached commits straight away, then bring them up to date
             self._update_commit_dropdown()
+            self._refresh_commits(event.number)
+
+            self._commit_marks()
 
             # Enable the TabbedContent (Marking, etc.)
             self.query_one(TabbedContent).disabled = False
@@ -146,6 +198,7 @@ class MarkingApp(App):
         # Enable/disable the buildmenu accordingly
         build_menu = self.query_one("#buildmenu")
         build_menu.disabled = self.active_commit is None
+        self._update_prebuild_status()
 
         # Update tooltip for the commit dropdown with commit message
         commit_dropdown = self.query_one("#commit-hash-dropdown", Select)
@@ -157,13 +210,77 @@ class MarkingApp(App):
             commit_dropdown.tooltip = ""
 
     def _update_commit_dropdown(self) -> None:
-        """Updates the commit hash dropdown with the latest commits."""
+        """
+        Fills the commit hash dropdown with the student's known commits and
+        selects the current commit in it.
+        """
         commit_hash_dropdown = self.query_one("#commit-hash-dropdown", Select)
+        commits = self.app_state.list_commits(self.app_state.student_number or "")
+        current = self.app_state.commit_hash
 
-        # commits = self.app_state.list_commits(self.app_state.student_number or "")
+        # Replacing the options clears the selection, which isn't the user's doing
+        with commit_hash_dropdown.prevent(Select.Changed):
+            commit_hash_dropdown.set_options(
+                [
+                    (f"{commit.hash[:16]}\n{commit.date}", commit.hash)
+                    for commit in commits
+                ]
+            )
+        if current in [commit.hash for commit in commits]:
+            commit_hash_dropdown.value = current
+        elif current is None:
+            commit_hash_dropdown.clear()
+        # Otherwise the commit isn't known yet, it is selected once
+        # _refresh_commits finds it
+
+    @work(exclusive=True, thread=True, group="commits")
+    def _refresh_commits(self, student_number: str) -> None:
+        """Brings the student's commits up to date in the background."""
+        before = self.app_state.list_commits(student_number)
+        commits = self.app_state.refresh_commits(student_number)
+        if commits != before:
+            self.call_from_thread(self._on_commits_refreshed, student_number)
+
+    @work(thread=True, group="marks_commit")
+    def _commit_marks(self) -> None:
+        """Commits the marks locally in the background once enough have changed."""
+        students = self.app_state.commit_marks_if_due()
+        if students:
+            self.call_from_thread(
+                self._set_sync_status, f"Committed {len(students)} students' marks"
+            )
+
+    def action_sync_marks(self) -> None:
+        """Commits, rebases and pushes all changed marks at once."""
+        self._sync_marks()
+
+    @work(exclusive=True, thread=True, group="marks_sync")
+    def _sync_marks(self) -> None:
+        result = self.app_state.sync_marks(
+            lambda status: self.call_from_thread(self._set_sync_status, status)
+        )
+        self.call_from_thread(self._set_sync_status, result.message)
+        # The sync may have brought in changes to the student being marked
+        self.call_from_thread(self.app_state.merge_marks_from_disk)
+        if result.failed:
+            severity = "error"
+        elif result.conflicts or result.kept_ours:
+            severity = "warning"
+        else:
+            severity = "information"
+        self.notify(message=result.message, severity=severity)
 
-        if self.app_state.commit_hash:
-            commit_hash_dropdown.value = self.app_state.commit_hash
+    def _set_sync_status(self, status: str) -> None:
+        self.query_one(Banner).sync_status = status
+
+    def _on_marks_merged(self) -> None:
+        self._build_criteria_panel()
+        if self.app_state.rubric:
+            self.query_one(MarkPanelRaw).show(self.app_state.rubric)
+
+    def _on_commits_refreshed(self, student_number: str) -> None:
+        if student_number == self.app_state.student_number:
+            self._update_commit_dropdown()
 
     @on(CriteriaSelect.Picked)
     def on_criteria_picked(self, event: CriteriaSelect.Picked) -> None:
@@ -178,7 +295,6 @@ class MarkingApp(App):
 
         self._update_commit_dropdown()
 
-
     @on(MarkSelected)
     def on_mark_selected(self, _event: MarkSelected) -> None:
         """
@@ -186,8 +302,7 @@ class MarkingApp(App):
         MarkPanelRaw text to show the new MD from AppState's rubric.
         """
         if self.app_state.rubric:
-            raw_panel = self.query_one(MarkPanelRaw)
-            raw_panel.text = self.app_state.rubric.into_md()
+            self.query_one(MarkPanelRaw).show(self.app_state.rubric)
 
     @on(CommentInput.CommentChanged)
     def on_comment_changed(self, _event: CommentInput.CommentChanged) -> None:
@@ -196,8 +311,7 @@ class MarkingApp(App):
         the MarkPanelRaw display text from AppState's rubric.
         """
         if self.app_state.rubric:
-            raw_panel = self.query_one(MarkPanelRaw)
-            raw_panel.text = self.app_state.rubric.into_md()
+            self.query_one(MarkPanelRaw).show(self.app_state.rubric)
 
     @on(BuildCommand)
     @work(exclusive=True, thread=True)
@@ -208,24 +322,103 @@ class MarkingApp(App):
         if "SOURCELIB_ROOT" not in os.environ:
             self.notify(message="SOURCELIB_ROOT is not set.", severity="error")
             return
+        log = self.query_one("#buildlog", BuildLog)
+        if message.type == "buildall":
+            self._build_all(log)
+            return
+
+        key = self.app_state.build_key()
+        if key and message.type in ("build", "rebuild", "flash"):
+            self._build_cached(
+                key, message.type == "flash", log, force=message.type == "rebuild"
+            )
+            return
+
         stage = self.app_state._normalize_stage_dir(self.app_state.stage)
         command = f"cd $SOURCELIB_ROOT/../repo/{stage}"
         if message.type == "build":
             command += " && make"
+        if message.type == "rebuild":
+            command += " && make clean && make"
         if message.type == "flash":
             command += " && make && make flash"
         if message.type == "clean":
             command += " && make clean"
-        log = self.query_one("#buildlog", Log)
-        with Popen(command, shell=True, stdout=PIPE, stderr=STDOUT) as p:
-            for line in p.stdout:
-                log.write_line(line.decode('utf8'))
-
+        log.start_capture(f"{self.app_state.student_number}-{stage}-{message.type}")
+        try:
+            with Popen(command, shell=True, stdout=PIPE, stderr=STDOUT) as p:
+                log.pump(p.stdout)
+        finally:
+            log.stop_capture()
+
+    def _build_cached(
+        self, key: BuildKey, flash: bool, log: BuildLog, force: bool = False
+    ) -> None:
+        """
+        Builds (or reuses the cached build of, unless force is set) the
+        current commit in its build cache sandbox, then optionally flashes
+        it from there.
+        """
+        cached = None if force else self.app_state.prebuilt_result()
+        if cached:
+            log.feed_line(f"Using cached build of {key.commit[:10]}")
+            log.replay(cached.log_path)
+            result = cached
+        else:
+            try:
+                result = self.app_state.build_current(key, log.feed, force)
+            finally:
+                log.end_output()
+        log.feed_line(f"Build {result.summary()}, log saved to {result.log_path}")
+        self.call_from_thread(self._update_prebuild_status)
+        if not flash or not result.success:
+            return
+        with Popen(
+            ["make", "flash"],
+            cwd=build_dir(key),
+            env=sandbox_env(key),
+            stdout=PIPE,
+            stderr=STDOUT,
+        ) as p:
+            log.pump(p.stdout)
+
+    def _build_all(self, log: BuildLog) -> None:
+        """Pre-builds every student's marked commit for the stage, from a worker."""
+        log.feed_line("Building all marked commits...")
+
+        def on_result(result: BuildResult) -> None:
+            log.feed_line(f"{result.student} {result.commit[:10]}: {result.summary()}")
+
+        results = self.app_state.build_stage(os.environ["SOURCELIB_ROOT"], on_result)
+        passed = len([r for r in results if r.success])
+        log.feed_line(f"{passed}/{len(results)} builds passed")
+        self.call_from_thread(self._update_prebuild_status)
+
+    @work(exclusive=True, thread=True, group="prebuild_status")
+    def _update_prebuild_status(self) -> None:
+        """
+        Shows whether the current commit has been pre-built, and how it went.
+        Finding its build key runs git status, so it's looked up off the UI
+        thread.
+        """
+        prebuilt = self.app_state.prebuilt_result()
+        if get_current_worker().is_cancelled:
+            return  # The commit changed meanwhile, a newer lookup will show it
+        self.call_from_thread(
+            self.query_one("#prebuild_status", Label).update,
+            f"Pre-built: {prebuilt.summary()}" if prebuilt else "Not pre-built",
+        )
 
     def _build_criteria_panel(self) -> None:
-        """Clears and re-populates the MarkPanel area with the current rubric."""
+        """
+        Shows the current rubric in the MarkPanel area. A MarkPanel already
+        showing the same layout is rebound to it, otherwise it is rebuilt.
+        """
         mark_panels = self.query("#mark_panel")
         for panel in mark_panels:
+            existing = panel.query(MarkPanel)
+            if existing and existing.first().bind(self.app_state.rubric):
+                continue
             panel.remove_children()
             if self.app_state.rubric:
                 panel.mount(MarkPanel(self.app_state.rubric))
@@ -234,7 +427,22 @@ class MarkingApp(App):
 
 
 def main():
-    MarkingApp().run()
+    parser = argparse.ArgumentParser(description="CSSE3010 marking tool.")
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="report how long each phase of starting up takes",
+    )
+    args = parser.parse_args()
+    STARTUP.enabled = args.profile_startup
+    STARTUP.end("imports")
+
+    STARTUP.begin("first paint")
+    with STARTUP.phase("app state"):
+        app = MarkingApp()
+    app.run()
+    if STARTUP.enabled:
+        print(STARTUP.report())
 
 
 if __name__ == "__main__":
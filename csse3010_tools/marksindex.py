@@ -0,0 +1,136 @@
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+MARKS_FILE = "marks.md"
+
+
+def student_for_dir(name: str) -> Optional[str]:
+    """
+    Marks directories are named after the student number without the 's'
+    plus a check digit, e.g. 12345678 for s1234567.
+    Returns the student number, or None for anything else.
+    """
+    if len(name) == 8 and name.isdigit():
+        return f"s{name[:-1]}"
+    return None
+
+
+@dataclass
+class StudentEntry:
+    directory: str
+    mtime: int
+    stages: List[str] = field(default_factory=list)
+
+
+class MarksIndex:
+    """
+    Where each student's marks live in a marks repo checkout:
+        <root>/<student number digits><check digit>/<stage>/marks.md
+
+    The layout is scanned once, and again only when the root (a student
+    was added) or a student's directory (a stage was added) is modified,
+    instead of probing for the directory on every read and write.
+    """
+
+    def __init__(self, root: str):
+        self._root = root
+        self._lock = threading.Lock()
+        self._mtime: Optional[int] = None
+        self._students: Dict[str, StudentEntry] = {}
+
+    @property
+    def root(self) -> str:
+        return self._root
+
+    def refresh(self, force: bool = False) -> None:
+        """
+        Rescans the root if it has changed since the last scan.
+        """
+        try:
+            mtime = os.stat(self._root).st_mtime_ns
+        except FileNotFoundError:
+            with self._lock:
+                self._mtime = None
+                self._students = {}
+            return
+        if not force and mtime == self._mtime:
+            return
+
+        students: Dict[str, StudentEntry] = {}
+        with os.scandir(self._root) as it:
+            for entry in it:
+                student = student_for_dir(entry.name)
+                if student and entry.is_dir():
+                    students[student] = self._scan_student(entry.path)
+        with self._lock:
+            self._mtime = mtime
+            self._students = students
+
+    def _scan_student(self, directory: str) -> StudentEntry:
+        with os.scandir(directory) as it:
+            stages = sorted(e.name for e in it if e.is_dir() and e.name != ".git")
+        return StudentEntry(directory, os.stat(directory).st_mtime_ns, stages)
+
+    def _entry(self, student: str) -> Optional[StudentEntry]:
+        self.refresh()
+        with self._lock:
+            entry = self._students.get(student)
+        if entry is None:
+            return None
+        try:
+            if os.stat(entry.directory).st_mtime_ns != entry.mtime:
+                entry = self._scan_student(entry.directory)
+                with self._lock:
+                    self._students[student] = entry
+        except FileNotFoundError:
+            self.refresh(force=True)
+            return None
+        return entry
+
+    def students(self) -> List[str]:
+        self.refresh()
+        with self._lock:
+            return sorted(self._students)
+
+    def student_dir(self, student: str) -> Optional[str]:
+        entry = self._entry(student)
+        return entry.directory if entry else None
+
+    def stages(self, student: str) -> List[str]:
+        entry = self._entry(student)
+        return list(entry.stages) if entry else []
+
+    def stage_dir(self, student: str, stage: str) -> Optional[str]:
+        """
+        The student's directory for the stage, or None if it doesn't exist.
+        """
+        entry = self._entry(student)
+        if entry is None or stage not in entry.stages:
+            return None
+        return os.path.join(entry.directory, stage)
+
+    def marks_path(self, student: str, stage: str) -> Optional[str]:
+        """
+        Where the student's marks for the stage are saved, or None if the
+        stage directory doesn't exist. The file itself may not exist yet.
+        """
+        stage_dir = self.stage_dir(student, stage)
+        return os.path.join(stage_dir, MARKS_FILE) if stage_dir else None
+
+    def all_marks(self, stage: Optional[str] = None) -> Iterator[Tuple[str, str, str]]:
+        """
+        Yields (student, stage, path) for every marks file that exists,
+        optionally only for one stage.
+        """
+        self.refresh()
+        with self._lock:
+            entries = sorted(self._students.items())
+        for student, entry in entries:
+            for entry_stage in entry.stages:
+                if stage is not None and entry_stage != stage:
+                    continue
+                path = os.path.join(entry.directory, entry_stage, MARKS_FILE)
+                if os.path.isfile(path):
+                    yield student, entry_stage, path
@@ -0,0 +1,73 @@
+import hashlib
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, List, Tuple
+
+if TYPE_CHECKING:
+    from csse3010_tools.rubric import Marks, RubricTemplate
+
+
+def blob_hash(content: str) -> str:
+    """
+    The git blob hash of content, what 'git hash-object' would print.
+    """
+    data = content.encode("utf8")
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+@dataclass
+class MergeResult:
+    marks: "Marks"
+    # Bands ('task.band') and comments ('task comment') changed on both
+    # sides to different values. Ours is kept, theirs is described here.
+    conflicts: List[str] = field(default_factory=list)
+
+
+def merge_marks(
+    template: "RubricTemplate", base: "Marks", ours: "Marks", theirs: "Marks"
+) -> MergeResult:
+    """
+    Three-way merges one student's marks band by band and comment by comment:
+    whichever side changed a value from base wins, and if both changed it
+    to different values ours is kept and the conflict reported.
+    """
+    merged = base.copy()
+    conflicts = []
+    for i, (task, band) in enumerate(template.slots):
+        value, conflict = _merge_value(
+            base.choices[i], ours.choices[i], theirs.choices[i]
+        )
+        merged.choices[i] = value
+        if conflict:
+            conflicts.append(f"{task}.{band} (theirs {theirs.choices[i]})")
+    for i, task in enumerate(template.task_names):
+        value, conflict = _merge_value(
+            base.comments[i], ours.comments[i], theirs.comments[i]
+        )
+        merged.comments[i] = value
+        if conflict:
+            conflicts.append(f"{task} comment (theirs {theirs.comments[i]!r})")
+    return MergeResult(merged, conflicts)
+
+
+def _merge_value(base, ours, theirs):
+    if ours == theirs or theirs == base:
+        return ours, False
+    if ours == base:
+        return theirs, False
+    return ours, True
+
+
+def merge_marks_md(
+    template: "RubricTemplate", base: str, ours: str, theirs: str
+) -> Tuple[str, List[str]]:
+    """
+    merge_marks on three versions of a marks.md, returning the merged
+    markdown and the conflicts.
+    """
+    result = merge_marks(
+        template,
+        template.parse_md(base)[0],
+        template.parse_md(ours)[0],
+        template.parse_md(theirs)[0],
+    )
+    return template.instantiate(result.marks).into_md(), result.conflicts
@@ -0,0 +1,116 @@
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+@dataclass
+class Diagnostic:
+    """
+    Something wrong with a marks table. line is 1-based, column is the
+    task name the cell is under (if any).
+    """
+
+    line: int
+    message: str
+    column: Optional[str] = None
+
+    def __str__(self) -> str:
+        where = f"line {self.line}" + (f", {self.column}" if self.column else "")
+        return f"{where}: {self.message}"
+
+
+@dataclass
+class ParsedMarks:
+    """
+    The contents of a marks table as written by Rubric.into_md.
+    found is False if there was no table at all.
+    """
+
+    choices: Dict[Tuple[str, str], int] = field(default_factory=dict)
+    comments: Dict[str, str] = field(default_factory=dict)
+    diagnostics: List[Diagnostic] = field(default_factory=list)
+    found: bool = False
+
+
+def _cells(line: str) -> List[str]:
+    # '| a. | 1 | 2 |' -> ['a.', '1', '2']
+    return [cell.strip() for cell in line.split("|")[1:-1]]
+
+
+def parse_marks_md(md: str, tasks: Iterable[str]) -> ParsedMarks:
+    """
+    Parses a marks table in a single pass over its lines:
+
+        | cid | dt1 | dt2 |
+        | -- | -- | -- |
+        | a. | 4 | 3 |
+        | avg. | 4.0 | 3.0 |
+        | comments | good | ok |
+
+    Columns are mapped to the given task names once, from the header. Cells
+    that can't be understood are skipped and reported as diagnostics,
+    nothing is printed.
+    """
+    known = set(tasks)
+    result = ParsedMarks()
+    columns: List[Optional[str]] = []
+    in_table = False
+    skip_alignment = False
+
+    for number, raw in enumerate(md.splitlines(), start=1):
+        line = raw.strip()
+        if not in_table:
+            if line[:5].lower() == "| cid":
+                header = _cells(line)
+                if not header or header[0].lower() != "cid":
+                    result.diagnostics.append(Diagnostic(number, "malformed header"))
+                    return result
+                result.found = True
+                for name in header[1:]:
+                    if name in known:
+                        columns.append(name)
+                    else:
+                        columns.append(None)
+                        result.diagnostics.append(
+                            Diagnostic(number, "unknown task", name)
+                        )
+                in_table = True
+                skip_alignment = True
+            continue
+
+        if skip_alignment:
+            skip_alignment = False
+            continue
+        if not line.startswith("|"):
+            break  # End of the table
+
+        cells = _cells(line)
+        if len(cells) < 2:
+            result.diagnostics.append(Diagnostic(number, "row has no cells"))
+            continue
+        if len(cells) - 1 > len(columns):
+            result.diagnostics.append(
+                Diagnostic(number, f"{len(cells) - 1 - len(columns)} extra cells")
+            )
+
+        label = cells[0].lower()
+        if label.startswith("avg"):
+            continue
+        is_comment = label.startswith("comment")
+        band = label.rstrip(".")
+
+        for task, cell in zip(columns, cells[1:]):
+            if task is None:
+                continue
+            if is_comment:
+                result.comments[task] = cell
+            elif cell != "-":
+                try:
+                    result.choices[(task, band)] = int(cell)
+                except ValueError:
+                    result.diagnostics.append(
+                        Diagnostic(number, f"band {band}: {cell!r} is not a mark", task)
+                    )
+
+    if not result.found:
+        result.diagnostics.append(Diagnostic(0, "no marks table found"))
+    return result
@@ -0,0 +1,287 @@
+import os
+import threading
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable, ContextManager, Dict, List, Optional, Tuple
+
+from csse3010_tools.marksindex import MARKS_FILE, student_for_dir
+
+if TYPE_CHECKING:
+    from git import Repo
+
+# Marks are committed locally once this many students have changes, and
+# everything left is committed (and pushed) when syncing.
+MARKS_COMMIT_EVERY = 10
+
+# Three-way merges a marks file: (path, base, ours, theirs) -> the merged
+# content and any conflicts resolved in our favour, or None if it can't.
+MarksMerge = Callable[[str, str, str, str], Optional[Tuple[str, List[str]]]]
+
+
+@dataclass
+class SyncResult:
+    # Students whose marks were committed by this sync
+    committed: List[str] = field(default_factory=list)
+    pushed: bool = False
+    # Students whose marks were changed both here and upstream, and merged
+    merged: List[str] = field(default_factory=list)
+    # Bands and comments both sides changed differently, where ours was kept
+    kept_ours: List[str] = field(default_factory=list)
+    # Students changed both here and upstream whose marks couldn't be merged
+    conflicts: List[str] = field(default_factory=list)
+    failed: bool = False
+    message: str = ""
+
+
+class MarksSync:
+    """
+    Commits and pushes the marks repo in batches: every changed marks.md
+    goes into one commit, and a sync is a single fetch, rebase and push.
+
+    Only the student directories we've committed changes to are checked
+    for upstream conflicts, everything else the other markers did is just
+    rebased onto. Marks files changed on both sides are merged band by band
+    with merge, if given.
+    """
+
+    def __init__(
+        self,
+        repo_dir: str,
+        commit_every: int = MARKS_COMMIT_EVERY,
+        merge: Optional[MarksMerge] = None,
+    ):
+        self._repo_dir = repo_dir
+        self._commit_every = commit_every
+        self._merge = merge
+        # Serialises git operations on the checkout
+        self._lock = threading.Lock()
+
+    @property
+    def repo(self) -> "Repo":
+        from git import Repo
+
+        return Repo(self._repo_dir)
+
+    def changed_marks(self) -> Dict[str, List[str]]:
+        """
+        Returns student number -> marks files changed but not committed.
+        """
+        status = self.repo.git.status(
+            "--porcelain", "-z", "--untracked-files=all", "--", f"*/{MARKS_FILE}"
+        )
+        changed: Dict[str, List[str]] = {}
+        for entry in status.split("\0"):
+            path = entry[3:]
+            student = student_for_dir(path.split("/", 1)[0]) if path else None
+            if student:
+                changed.setdefault(student, []).append(path)
+        return changed
+
+    def commit(self, minimum: int = 1) -> List[str]:
+        """
+        Commits every changed marks file in a single commit, if at least
+        minimum students have changes. Returns the students committed.
+        """
+        with self._lock:
+            return self._commit(minimum)
+
+    def commit_if_due(self) -> List[str]:
+        """
+        Commits once MARKS_COMMIT_EVERY students have changes.
+        """
+        return self.commit(self._commit_every)
+
+    def _commit(self, minimum: int) -> List[str]:
+        changed = self.changed_marks()
+        if not changed or len(changed) < minimum:
+            return []
+        repo = self.repo
+        paths = [path for paths in changed.values() for path in paths]
+        repo.git.add("--", *paths)
+        students = sorted(changed)
+        message = f"Marks for {len(students)} students\n\n" + "\n".join(students)
+        repo.git.commit("--quiet", "-m", message, "--", *paths)
+        print(f"Committed marks for {len(students)} students")
+        return students
+
+    def _upstream(self, repo: "Repo") -> str:
+        from git.exc import GitCommandError
+
+        try:
+            return repo.git.rev_parse("--abbrev-ref", "@{upstream}")
+        except GitCommandError:
+            return f"origin/{repo.active_branch.name}"
+
+    def _touched_students(self, repo: "Repo", upstream: str) -> Dict[str, str]:
+        """
+        Student number -> directory, of every student changed by our commits
+        that aren't upstream yet.
+        """
+        names = repo.git.diff("--name-only", f"{upstream}...HEAD").splitlines()
+        touched = {}
+        for name in names:
+            directory = name.split("/", 1)[0]
+            student = student_for_dir(directory)
+            if student:
+                touched[student] = directory
+        return touched
+
+    def _show(self, repo: "Repo", rev: str, path: str) -> str:
+        """
+        The content of path at rev, empty if it didn't exist there.
+        """
+        from git.exc import GitCommandError
+
+        try:
+            return repo.git.show(f"{rev}:{path}", strip_newline_in_stdout=False)
+        except GitCommandError:
+            return ""
+
+    def _merge_both_changed(
+        self,
+        repo: "Repo",
+        base: str,
+        upstream: str,
+        paths: List[str],
+        result: SyncResult,
+    ) -> Dict[str, str]:
+        """
+        Merges each marks file changed both by us and upstream since base.
+        Returns path -> merged content; students whose files couldn't be
+        merged are added to result.conflicts.
+        """
+        merged = {}
+        for path in paths:
+            student = student_for_dir(path.split("/", 1)[0]) or path
+            resolved = None
+            if self._merge and path.endswith(MARKS_FILE):
+                resolved = self._merge(
+                    path,
+                    self._show(repo, base, path),
+                    self._show(repo, "HEAD", path),
+                    self._show(repo, upstream, path),
+                )
+            if resolved is None:
+                result.conflicts.append(student)
+                continue
+            merged[path], kept_ours = resolved
+            result.kept_ours += [f"{student} {where}" for where in kept_ours]
+            if student not in result.merged:
+                result.merged.append(student)
+        result.conflicts = sorted(set(result.conflicts))
+        return merged
+
+    def sync(
+        self,
+        report: Optional[Callable[[str], None]] = None,
+        hold: Callable[[], ContextManager] = nullcontext,
+    ) -> SyncResult:
+        """
+        Fetches, commits any remaining changes, rebases onto upstream and
+        pushes. Marks someone else changed for a student we changed are
+        merged and committed on top; if any can't be merged nothing is
+        rebased or pushed and the students are reported as conflicts.
+
+        Everything from the commit to the merge commit runs inside hold(),
+        which should stop anything else writing to the checkout meanwhile
+        (MarksWriter.paused), the fetch and push happen outside it.
+        """
+        report = report or print
+        result = SyncResult()
+        with self._lock:
+            repo = self.repo
+            upstream = self._upstream(repo)
+            remote = upstream.split("/", 1)[0]
+
+            report(f"Fetching {remote}")
+            repo.git.fetch("--quiet", remote)
+
+            with hold():
+                touched = self._rebase(repo, upstream, report, result)
+            if touched is None:
+                return result
+            if not touched:
+                result.message = "Marks are up to date"
+                return result
+
+            report("Pushing")
+            repo.git.push("--quiet", remote, f"HEAD:{upstream.split('/', 1)[1]}")
+            result.pushed = True
+            result.message = f"Pushed marks for {len(touched)} students"
+            if result.merged:
+                result.message += f", merged {len(result.merged)} also changed upstream"
+            if result.kept_ours:
+                result.message += f", kept ours for {', '.join(result.kept_ours)}"
+            return result
+
+    def _rebase(
+        self,
+        repo: "Repo",
+        upstream: str,
+        report: Callable[[str], None],
+        result: SyncResult,
+    ) -> Optional[Dict[str, str]]:
+        """
+        The part of sync that changes the checkout: commits, merges and
+        rebases onto upstream. Returns the students we changed, or None if
+        nothing should be pushed (result says why).
+        """
+        from git.exc import GitCommandError
+
+        report("Committing marks")
+        result.committed = self._commit(1)
+        touched = self._touched_students(repo, upstream)
+        if not touched:
+            return touched
+
+        base = repo.git.merge_base("HEAD", upstream)
+        directories = sorted(set(touched.values()))
+        theirs = repo.git.diff(
+            "--name-only", base, upstream, "--", *directories
+        ).splitlines()
+        ours = set(
+            repo.git.diff("--name-only", base, "HEAD", "--", *directories).splitlines()
+        )
+        merged = self._merge_both_changed(
+            repo, base, upstream, [path for path in theirs if path in ours], result
+        )
+        if result.conflicts:
+            result.message = (
+                f"Not pushed, {len(result.conflicts)} students were also "
+                f"changed upstream: {', '.join(result.conflicts)}"
+            )
+            return None
+
+        report(f"Rebasing onto {upstream}")
+        try:
+            # Files both sides changed are overwritten with the merge below
+            args = ["-X", "theirs"] if merged else []
+            repo.git.rebase("--quiet", *args, upstream)
+        except GitCommandError as e:
+            # Only if it got as far as starting, a rebase refused up front
+            # (say over a dirty tree) has nothing to abort
+            if any(
+                os.path.isdir(os.path.join(repo.git_dir, state))
+                for state in ("rebase-merge", "rebase-apply")
+            ):
+                repo.git.rebase("--abort")
+            result.failed = True
+            result.message = f"Rebase failed, nothing pushed: {e}"
+            return None
+
+        if merged:
+            for path, content in merged.items():
+                with open(os.path.join(self._repo_dir, path), "w") as f:
+                    f.write(content)
+            paths = sorted(merged)
+            repo.git.add("--", *paths)
+            if repo.git.diff("--cached", "--name-only", "--", *paths):
+                repo.git.commit(
+                    "--quiet",
+                    "-m",
+                    f"Merge marks for {len(result.merged)} students\n\n"
+                    + "\n".join(result.merged),
+                    "--",
+                    *paths,
+                )
+        return touched
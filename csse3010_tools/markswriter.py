@@ -0,0 +1,198 @@
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+# Edits to the same file within this long of each other are saved together.
+MARKS_WRITE_DELAY = 0.5
+
+# But a file that keeps changing is still saved at least this often.
+MARKS_WRITE_MAX_DELAY = 5.0
+
+
+def write_atomic(path: str, content: str) -> None:
+    """
+    Writes content to path via a temporary file in the same directory and
+    a rename, so a crash never leaves a half written file behind.
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".", prefix=f".{os.path.basename(path)}."
+    )
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        # mkstemp makes the file private, keep the mode of what we replace
+        mode = os.stat(path).st_mode if os.path.exists(path) else 0o644
+        os.chmod(tmp_path, mode & 0o777)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class MarksWriter:
+    """
+    Write-behind saving of marks files, off the UI thread.
+
+    schedule() is cheap and can be called on every edit: the content is only
+    rendered and written once the file has been left alone for
+    MARKS_WRITE_DELAY, and not at all if it hasn't changed since the last
+    write. Call flush() (or shutdown()) to save everything pending right away.
+    """
+
+    def __init__(
+        self,
+        delay: float = MARKS_WRITE_DELAY,
+        max_delay: float = MARKS_WRITE_MAX_DELAY,
+        on_error: Optional[Callable[[str, Exception], None]] = None,
+        on_written: Optional[Callable[[str], None]] = None,
+    ):
+        self._delay = delay
+        self._max_delay = max_delay
+        self._on_error = on_error
+        self._on_written = on_written
+        self._cond = threading.Condition()
+        # path -> (due time, first scheduled time, render)
+        self._pending: Dict[str, Tuple[float, float, Callable[[], str]]] = {}
+        # path -> (mtime, content) of what we last saw on disk
+        self._written: Dict[str, Tuple[int, str]] = {}
+        self._writing = 0
+        self._paused = 0
+        self._stopped = False
+        self._thread = threading.Thread(
+            target=self._run, name="marks-writer", daemon=True
+        )
+        self._thread.start()
+
+    def schedule(self, path: str, render: Callable[[], str]) -> None:
+        """
+        Queues path to be saved with whatever render() returns when it is
+        written. Rescheduling a pending path just pushes its write back.
+        """
+        now = time.monotonic()
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("MarksWriter has been shut down")
+            pending = self._pending.get(path)
+            first = pending[1] if pending else now
+            due = min(now + self._delay, first + self._max_delay)
+            self._pending[path] = (due, first, render)
+            self._cond.notify()
+
+    def flush(self) -> None:
+        """
+        Writes everything pending now, and waits for it to be on disk.
+        """
+        with self._cond:
+            for path, (_, first, render) in self._pending.items():
+                self._pending[path] = (0.0, first, render)
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: not self._pending and not self._writing)
+
+    @contextmanager
+    def paused(self) -> Iterator[None]:
+        """
+        Writes everything pending, then holds any new writes back until the
+        block exits, for git operations that need the checkout to stay put.
+        flush() waits for the block to exit too, so keep it short.
+        """
+        with self._cond:
+            for path, (_, first, render) in self._pending.items():
+                self._pending[path] = (0.0, first, render)
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: not self._pending and not self._writing)
+            self._paused += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._paused -= 1
+                self._cond.notify_all()
+
+    def shutdown(self) -> None:
+        """
+        Flushes and stops the writer thread.
+        """
+        self.flush()
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped and not self._pending:
+                        return
+                    if self._paused:
+                        self._cond.wait()
+                        continue
+                    now = time.monotonic()
+                    due = [
+                        p for p, (when, _, _) in self._pending.items() if when <= now
+                    ]
+                    if due:
+                        break
+                    timeout = (
+                        min(when for when, _, _ in self._pending.values()) - now
+                        if self._pending
+                        else None
+                    )
+                    self._cond.wait(timeout)
+                batch = {path: self._pending.pop(path)[2] for path in due}
+                self._writing += 1
+
+            errors = []
+            try:
+                for path, render in batch.items():
+                    error = self._write(path, render)
+                    if error:
+                        errors.append((path, error))
+            finally:
+                with self._cond:
+                    self._writing -= 1
+                    self._cond.notify_all()
+
+            # Only reported once flush() can return, so a handler that waits
+            # on the UI thread can't deadlock with a flush() there
+            if self._on_error:
+                for path, error in errors:
+                    self._on_error(path, error)
+
+    def _on_disk(self, path: str) -> Optional[str]:
+        """
+        The current content of path, only read again if it has been
+        modified since we last wrote or read it.
+        """
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        cached = self._written.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(path, "r") as f:
+            content = f.read()
+        self._written[path] = (mtime, content)
+        return content
+
+    def _write(self, path: str, render: Callable[[], str]) -> Optional[Exception]:
+        """
+        Renders and writes path, returning the error if that failed.
+        """
+        try:
+            content = render()
+            if self._on_disk(path) == content:
+                return None
+            write_atomic(path, content)
+            self._written[path] = (os.stat(path).st_mtime_ns, content)
+            print(f"Wrote marks to {path}")
+            if self._on_written:
+                self._on_written(path)
+        except Exception as e:
+            print(f"Failed to write marks to {path}: {e}")
+            return e
+        return None
@@ -0,0 +1,186 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from csse3010_tools.repostore import RepoStore, dir_size
+
+# How many students after the current one are checked out in the background.
+PREFETCH_COUNT = 3
+PREFETCH_WORKERS = 2
+
+# Total size the student worktrees may take up before the least recently
+# used ones are removed. Their objects stay in the repo store.
+WORKTREE_DISK_BUDGET = 4 * 1024**3
+
+# (student number, ssh url, commit hash or None for the default branch)
+PrefetchItem = Tuple[str, Optional[str], Optional[str]]
+
+
+class Prefetcher:
+    """
+    Checks out upcoming students' repos in a background thread pool, so that
+    switching to them only has to wait for a no-op checkout.
+    Worktrees are evicted least recently used first once they go over the
+    disk budget. A worktree's mtime is its last use, so this survives restarts.
+    """
+
+    def __init__(
+        self,
+        store: RepoStore,
+        count: int = PREFETCH_COUNT,
+        workers: int = PREFETCH_WORKERS,
+        disk_budget: int = WORKTREE_DISK_BUDGET,
+    ):
+        self._store = store
+        self._count = count
+        self._disk_budget = disk_budget
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="prefetch"
+        )
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Tuple[Optional[str], Future]] = {}
+        self._sizes: Dict[str, int] = {}
+        self._keep: Set[str] = set()
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def checkout(
+        self, student: str, ssh_url: Optional[str], commit: Optional[str]
+    ) -> "Future[str]":
+        """
+        Checks out the student's repo, returning a future of its path.
+
+        If the store already has the commit and no prefetch of the student
+        is running, this happens right away and the future is done. Otherwise
+        it is left to the pool (after the prefetch, so the two never touch
+        one worktree), so the caller never waits on the network.
+        """
+        with self._lock:
+            # Not to be evicted from under us, schedule() keeps it from now on
+            self._keep.add(student)
+            pending = self._pending.get(student)
+        busy = pending is not None and not pending[1].done()
+
+        future: "Future[str]" = Future()
+        if not busy and not self._store.needs_fetch(student, commit):
+            try:
+                future.set_result(self._checkout(student, ssh_url, commit))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        def start(_=None) -> None:
+            try:
+                job = self._pool.submit(self._checkout, student, ssh_url, commit)
+            except RuntimeError as e:
+                future.set_exception(e)  # Shut down meanwhile
+                return
+            job.add_done_callback(lambda done: _copy_outcome(done, future))
+
+        with self._lock:
+            self._pending[student] = (commit, future)
+        if busy:
+            pending[1].add_done_callback(start)
+        else:
+            start()
+        return future
+
+    def _checkout(
+        self, student: str, ssh_url: Optional[str], commit: Optional[str]
+    ) -> str:
+        local_dir = self._store.checkout(student, ssh_url, commit)
+        self._touch(student)
+        return local_dir
+
+    def schedule(self, current: str, upcoming: Iterable[PrefetchItem]) -> None:
+        """
+        Queues the next students for checkout. Anything already prefetched
+        at the same commit is left alone.
+        """
+        items: List[PrefetchItem] = list(upcoming)[: self._count]
+        with self._lock:
+            self._keep = {current} | {student for student, _, _ in items}
+            for student, ssh_url, commit in items:
+                pending = self._pending.get(student)
+                if pending and pending[0] == commit:
+                    continue
+                self._pending[student] = (
+                    commit,
+                    self._pool.submit(self._prefetch, student, ssh_url, commit),
+                )
+
+    def _prefetch(
+        self, student: str, ssh_url: Optional[str], commit: Optional[str]
+    ) -> None:
+        try:
+            if commit is None:
+                # Bring the default branch up to date, checkout() won't
+                self._store.fetch(student, ssh_url)
+            self._checkout(student, ssh_url, commit)
+            print(f"Prefetched {student} at {commit or 'HEAD'}")
+        except Exception as e:
+            print(f"Could not prefetch {student}:\n{e}")
+            with self._lock:
+                self._pending.pop(student, None)
+            raise
+        self.evict()
+
+    def _touch(self, student: str) -> None:
+        local_dir = self._store.worktree_path(student)
+        if os.path.isdir(local_dir):
+            os.utime(local_dir)
+        with self._lock:
+            self._sizes.pop(student, None)
+
+    def evict(self) -> None:
+        """
+        Removes least recently used worktrees until they fit the disk budget,
+        never touching the current or upcoming students.
+        """
+        root = os.path.dirname(self._store.worktree_path("_"))
+        if not os.path.isdir(root):
+            return
+
+        entries = []
+        for student in os.listdir(root):
+            path = os.path.join(root, student)
+            if not os.path.isdir(path):
+                continue
+            with self._lock:
+                size = self._sizes.get(student)
+            if size is None:
+                size = dir_size(path)
+                with self._lock:
+                    self._sizes[student] = size
+            entries.append((os.stat(path).st_mtime, student, size))
+
+        total = sum(size for _, _, size in entries)
+        for _, student, size in sorted(entries):
+            if total <= self._disk_budget:
+                break
+            # Removed with the lock held, so checkout() can't start on it
+            # between the check and the removal
+            with self._lock:
+                if student in self._keep:
+                    continue
+                pending = self._pending.get(student)
+                if pending and not pending[1].done():
+                    continue
+                self._pending.pop(student, None)
+                self._sizes.pop(student, None)
+                print(f"Evicting {student}'s checkout ({size // 1024**2} MiB)")
+                self._store.remove_worktree(student)
+            total -= size
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _copy_outcome(source: Future, target: Future) -> None:
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
@@ -0,0 +1,241 @@
+import os
+import shutil
+import threading
+from typing import TYPE_CHECKING, Optional
+
+# git is imported when the store is first used, not at startup
+if TYPE_CHECKING:
+    from git import Repo
+
+# A single bare repository holding the objects of every student repo.
+# Each student is a remote of it, and gets their own worktree under
+# WORKTREE_ROOT, so history shared between students (sourcelib skeletons,
+# vendor code) is only stored and fetched once.
+STORE_PATH = os.path.join("temporary", "objects.git")
+WORKTREE_ROOT = os.path.join("temporary", "repo")
+
+
+def dir_size(path: str) -> int:
+    """
+    Total size of the files under path, not following symlinks.
+    """
+    total = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.lstat(os.path.join(root, file)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class RepoStore:
+    def __init__(self, path: str = STORE_PATH, worktree_root: str = WORKTREE_ROOT):
+        self._path = path
+        self._worktree_root = worktree_root
+        self._repo: Optional["Repo"] = None
+
+        # Serialises changes to the store's config and worktree list,
+        # which git guards with lock files that fail rather than wait.
+        self._lock = threading.RLock()
+
+    @property
+    def repo(self) -> "Repo":
+        """
+        The bare store repository, created on first use.
+        """
+        if self._repo is None:
+            with self._lock:
+                if self._repo is None:
+                    self._repo = self._open_or_init()
+        return self._repo
+
+    def _open_or_init(self) -> "Repo":
+        from git import Repo
+
+        if os.path.exists(os.path.join(self._path, "HEAD")):
+            return Repo(self._path)
+        print(f"Creating shared repo store in: {self._path}")
+        repo = Repo.init(self._path, bare=True, mkdir=True)
+        with repo.config_writer() as config:
+            # Keep a reflog of remote-tracking refs even though we are bare,
+            # so hashes.py can tell when a commit was first fetched.
+            config.set_value("core", "logAllRefUpdates", "always")
+            # Fetches run concurrently, so don't let them race on FETCH_HEAD
+            # or kick off an automatic gc in the middle of another fetch.
+            config.set_value("fetch", "writeFetchHead", "false")
+            config.set_value("gc", "auto", "0")
+        return repo
+
+    def worktree_path(self, student: str) -> str:
+        return os.path.join(self._worktree_root, student)
+
+    def default_ref(self, student: str) -> str:
+        """
+        The ref holding the tip of the student's default branch.
+        """
+        return f"refs/remotes/{student}/HEAD"
+
+    def has_remote(self, student: str) -> bool:
+        return student in [remote.name for remote in self.repo.remotes]
+
+    def has_commit(self, sha: str) -> bool:
+        from git.exc import GitCommandError
+
+        try:
+            self.repo.git.cat_file("-e", f"{sha}^{{commit}}")
+            return True
+        except GitCommandError:
+            return False
+
+    def has_ref(self, ref: str) -> bool:
+        from git.exc import GitCommandError
+
+        try:
+            self.repo.git.rev_parse("--verify", "--quiet", ref)
+            return True
+        except GitCommandError:
+            return False
+
+    def needs_fetch(self, student: str, commit: Optional[str] = None) -> bool:
+        """
+        True if checking out commit (or the student's default branch) has
+        to fetch first, because the store doesn't have it yet.
+        """
+        if commit:
+            return not self.has_commit(commit)
+        return not self.has_ref(self.default_ref(student))
+
+    def _ensure_remote(self, student: str, ssh_url: Optional[str]) -> None:
+        with self._lock:
+            if self.has_remote(student):
+                if ssh_url and self.repo.remote(student).url != ssh_url:
+                    self.repo.git.remote("set-url", student, ssh_url)
+                return
+            if not ssh_url:
+                raise ValueError(f"No remote or url known for {student}")
+            self.repo.git.remote("add", "--no-tags", student, ssh_url)
+            # Also track the remote's HEAD as a plain ref, so we don't need
+            # to know each student's default branch name.
+            self.repo.git.config(
+                "--add", f"remote.{student}.fetch", f"+HEAD:{self.default_ref(student)}"
+            )
+
+    def fetch(self, student: str, ssh_url: Optional[str] = None) -> None:
+        """
+        Incrementally fetches the student's repo into the store.
+        Only objects not already in the store are transferred.
+        """
+        self._ensure_remote(student, ssh_url)
+        print(f"Fetching {student}'s repo into the store")
+        self.repo.git.fetch("--quiet", "--prune", student)
+
+    def _adopt_clone(self, student: str, local_dir: str) -> None:
+        """
+        Moves the objects of an old standalone clone into the store, so
+        replacing it with a worktree doesn't have to fetch them again.
+        Refuses (raises) if the clone has local changes or commits that
+        replacing it would lose.
+        """
+        from git import Repo
+        from git.exc import GitCommandError
+
+        clone = Repo(local_dir)
+        if clone.git.status("--porcelain") or clone.git.log(
+            "--branches", "--not", "--remotes", "--oneline"
+        ):
+            raise RuntimeError(
+                f"{local_dir} is an old clone with uncommitted or unpushed "
+                "changes, move them somewhere safe and remove it to continue"
+            )
+        try:
+            self.repo.git.fetch(
+                "--quiet",
+                os.path.abspath(local_dir),
+                f"+refs/remotes/origin/*:refs/remotes/{student}/*",
+            )
+        except GitCommandError as e:
+            print(f"Could not adopt {student}'s old clone: {e}")
+
+    def is_clean(self, path: str) -> bool:
+        """
+        True if the worktree at path has no changes to tracked files,
+        i.e. it matches the commit it has checked out.
+        """
+        from git import Repo
+
+        try:
+            return not Repo(path).git.status("--porcelain", "--untracked-files=no")
+        except Exception:
+            return False
+
+    def _is_worktree(self, local_dir: str) -> bool:
+        return os.path.isfile(os.path.join(local_dir, ".git"))
+
+    def add_worktree(self, path: str, target: str) -> None:
+        """
+        Creates a detached worktree of the store at path, replacing anything
+        already there.
+        """
+        with self._lock:
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            self.repo.git.worktree("prune")
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.repo.git.worktree(
+                "add", "--detach", "--force", os.path.abspath(path), target
+            )
+
+    def remove_worktree_at(self, path: str) -> None:
+        """
+        Removes the worktree at path. Its objects stay in the store.
+        """
+        with self._lock:
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            self.repo.git.worktree("prune")
+
+    def remove_worktree(self, student: str) -> None:
+        """
+        Removes the student's checkout. Their objects stay in the store.
+        """
+        self.remove_worktree_at(self.worktree_path(student))
+
+    def checkout(
+        self,
+        student: str,
+        ssh_url: Optional[str] = None,
+        commit: Optional[str] = None,
+    ) -> str:
+        """
+        Makes temporary/repo/<student> a worktree of the store checked out at
+        commit (or the tip of the default branch), and returns its path.
+
+        The store is only fetched when the commit (or, for the default
+        branch, any fetch of it) isn't already in it, see needs_fetch; the
+        default branch is otherwise as of its last fetch. A corrupted
+        checkout is repaired by recreating the worktree, which doesn't
+        refetch any objects.
+        """
+        from git import Repo
+
+        local_dir = self.worktree_path(student)
+        if os.path.isdir(os.path.join(local_dir, ".git")):
+            print(f"Moving {student}'s old clone into the shared store")
+            self._adopt_clone(student, local_dir)
+
+        if self.needs_fetch(student, commit):
+            self.fetch(student, ssh_url)
+        target = commit or self.default_ref(student)
+
+        if self._is_worktree(local_dir):
+            try:
+                Repo(local_dir).git.checkout("--detach", target)
+                print(f"Checked out {target} for {student}")
+                return local_dir
+            except Exception as e:
+                print(f"Worktree for {student} is broken ({e}), recreating it")
+
+        print(f"Creating worktree for {student} at {target}")
+        self.add_worktree(local_dir, target)
+        return local_dir
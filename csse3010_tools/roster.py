@@ -0,0 +1,252 @@
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+if TYPE_CHECKING:
+    from gitea import Gitea
+
+ROSTER_CACHE_PATH = os.path.join("temporary", "roster.json")
+ROSTER_CACHE_VERSION = 1
+
+# How long a cached roster is trusted before it is revalidated against Gitea.
+ROSTER_MAX_AGE = 12 * 60 * 60
+
+# Number of concurrent Gitea requests used when (re)building the roster.
+ROSTER_WORKERS = 16
+
+# Page size for the admin user listing, Gitea clamps this to MAX_RESPONSE_ITEMS.
+USERS_PAGE_LIMIT = 50
+
+# Newly resolved students are passed to on_progress this many at a time.
+ROSTER_PROGRESS_BATCH = 50
+
+_STUDENT_PATTERN = re.compile(r"s\d{7}")
+
+
+@dataclass
+class Student:
+    username: str
+    full_name: str
+    org: Optional[str] = None
+    ssh_url: Optional[str] = None
+    # The repo's updated_at when we last looked, to tell if it has changed
+    repo_updated: Optional[str] = None
+
+    @property
+    def has_repo(self) -> bool:
+        return self.org is not None and self.ssh_url is not None
+
+
+@dataclass
+class Roster:
+    students: Dict[str, Student]
+    fetched_at: float = 0.0
+
+    def is_fresh(self, max_age: float = ROSTER_MAX_AGE) -> bool:
+        return time.time() - self.fetched_at < max_age
+
+
+def is_student_username(username: str) -> bool:
+    return bool(_STUDENT_PATTERN.search(username))
+
+
+def load_roster(path: str = ROSTER_CACHE_PATH) -> Optional[Roster]:
+    """
+    Loads the cached roster from disk.
+    Returns None if there is no cache, or it is unreadable/out of date.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+        if data.get("version") != ROSTER_CACHE_VERSION:
+            return None
+        students = {
+            username: Student(**entry)
+            for username, entry in data.get("students", {}).items()
+        }
+        return Roster(students=students, fetched_at=data.get("fetched_at", 0.0))
+    except Exception as e:
+        print(f"Failed to read roster cache {path}: {e}")
+        return None
+
+
+def save_roster(roster: Roster, path: str = ROSTER_CACHE_PATH) -> None:
+    """
+    Writes the roster to disk, replacing any previous cache atomically.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = {
+        "version": ROSTER_CACHE_VERSION,
+        "fetched_at": roster.fetched_at,
+        "students": {
+            username: asdict(student) for username, student in roster.students.items()
+        },
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def _fetch_user_page(gitea: "Gitea", page: int) -> List[dict]:
+    return gitea.requests_get(
+        "/admin/users", params={"page": page, "limit": USERS_PAGE_LIMIT}
+    )
+
+
+def _fetch_users(gitea: "Gitea", pool: ThreadPoolExecutor) -> List[dict]:
+    """
+    Lists every Gitea user. The first page tells us the total count, the
+    remaining pages are then requested concurrently.
+    """
+    response = gitea._requests_get(
+        "/admin/users", params={"page": 1, "limit": USERS_PAGE_LIMIT}
+    )
+    users = list(gitea.parse_result(response) or [])
+    total = int(response.headers.get("X-Total-Count", len(users)))
+    if not users or len(users) >= total:
+        return users
+
+    page_size = len(users)
+    pages = range(2, (total + page_size - 1) // page_size + 1)
+    for page in pool.map(lambda p: _fetch_user_page(gitea, p), pages):
+        users.extend(page or [])
+    return users
+
+
+def _resolve_student(gitea: "Gitea", user: dict) -> Student:
+    """
+    Finds the student's 'repo' repository inside the org that contains their
+    student number.
+    """
+    username = user["username"]
+    student = Student(username=username, full_name=user.get("full_name", ""))
+    try:
+        orgs = gitea.requests_get_paginated(f"/users/{username}/orgs")
+        for org in orgs:
+            org_name = org.get("name") or org.get("username")
+            if not org_name or username[1:] not in org_name:
+                continue
+            for repo in gitea.requests_get_paginated(f"/orgs/{org_name}/repos"):
+                if repo["name"] == "repo":
+                    student.org = org_name
+                    student.ssh_url = repo["ssh_url"]
+                    student.repo_updated = repo.get("updated_at")
+                    return student
+    except Exception as e:
+        print(f"Could not resolve repo for {username}: {e}")
+    return student
+
+
+def _revalidate_student(gitea: "Gitea", student: Student) -> bool:
+    """
+    Checks a cached student's repo is still <org>/repo, refreshing the entry
+    if the repo was updated since we last looked. Returns False if the repo
+    has moved or gone and the student needs resolving again.
+    """
+    from gitea.exceptions import NotFoundException
+
+    try:
+        repo = gitea.requests_get(f"/repos/{student.org}/repo")
+    except NotFoundException:
+        return False
+    except Exception as e:
+        # Keep what we had rather than lose the repo over a network error
+        print(f"Could not revalidate repo for {student.username}: {e}")
+        return True
+    if repo.get("updated_at") == student.repo_updated:
+        return True
+    owner = repo.get("owner") or {}
+    if repo.get("name") != "repo" or owner.get("username", student.org) != student.org:
+        return False  # Renamed or transferred, we were redirected
+    student.ssh_url = repo["ssh_url"]
+    student.repo_updated = repo.get("updated_at")
+    return True
+
+
+def fetch_roster(
+    gitea: "Gitea",
+    previous: Optional[Roster] = None,
+    workers: int = ROSTER_WORKERS,
+    on_progress: Optional[Callable[[int, int, List[Student]], None]] = None,
+) -> Roster:
+    """
+    Builds the roster from Gitea using a pool of concurrent requests.
+
+    If a previous roster is given it is revalidated rather than rebuilt:
+    students whose repo is already known keep their cached entry (with the
+    name refreshed from the user listing) as long as a single request shows
+    the repo is still there, and only new students, ones without a repo or
+    whose repo moved are resolved against the API.
+
+    on_progress, if given, is called with (resolved, total, students) as
+    students are resolved, where students are those resolved since the
+    last call: the known ones first, then ROSTER_PROGRESS_BATCH at a time.
+    """
+    known = previous.students if previous else {}
+    students: Dict[str, Student] = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        users = [
+            u for u in _fetch_users(gitea, pool) if is_student_username(u["username"])
+        ]
+
+        to_resolve = []
+        to_revalidate = []
+        for user in users:
+            cached = known.get(user["username"])
+            if cached and cached.has_repo:
+                cached.full_name = user.get("full_name", cached.full_name)
+                to_revalidate.append((user, cached))
+            else:
+                to_resolve.append(user)
+        revalidated = pool.map(
+            lambda entry: _revalidate_student(gitea, entry[1]), to_revalidate
+        )
+        for (user, cached), still_valid in zip(to_revalidate, revalidated):
+            if still_valid:
+                students[cached.username] = cached
+            else:
+                to_resolve.append(user)
+
+        resolved = len(students)
+        total = len(users)
+        if on_progress:
+            on_progress(resolved, total, list(students.values()))
+        batch: List[Student] = []
+        for student in pool.map(lambda u: _resolve_student(gitea, u), to_resolve):
+            students[student.username] = student
+            resolved += 1
+            batch.append(student)
+            if on_progress and len(batch) >= ROSTER_PROGRESS_BATCH:
+                on_progress(resolved, total, batch)
+                batch = []
+        if on_progress and batch:
+            on_progress(resolved, total, batch)
+
+    print(f"Roster: {len(students)} students ({len(to_resolve)} resolved from Gitea)")
+    return Roster(students=students, fetched_at=time.time())
+
+
+def get_roster(
+    gitea: "Gitea",
+    path: str = ROSTER_CACHE_PATH,
+    max_age: float = ROSTER_MAX_AGE,
+) -> Roster:
+    """
+    Returns the roster, preferring the on-disk cache while it is fresh and
+    otherwise revalidating it against Gitea and saving the result.
+    """
+    cached = load_roster(path)
+    if cached and cached.is_fresh(max_age):
+        return cached
+
+    roster = fetch_roster(gitea, previous=cached)
+    save_roster(roster, path)
+    return roster
@@ -1,9 +1,12 @@
-from typing import List, Dict, DefaultDict, Self
+import threading
+from typing import List, Dict, DefaultDict, Self, Tuple
 from types import NotImplementedType
 from serde import serialize, deserialize, yaml, serde, field
 from serde.yaml import from_yaml, to_yaml
 from dataclasses import dataclass
 
+from csse3010_tools.marksparser import Diagnostic, parse_marks_md
+
 
 def common_entries(*dcts):
     if not dcts:
@@ -67,7 +70,7 @@ class Task:
                     3: "Competent",
                     4: "Proficient",
                     5: "Exemplary",
-                }
+                },
             )
         else:
             object.__setattr__(
@@ -75,27 +78,51 @@ class Task:
                 "headings",
                 headings,
             )
+        self.reset_totals()
+
+    def reset_totals(self) -> None:
+        """
+        Drops the cached sum and max/min marks, call after changing the
+        bands or their choices other than through set_choice.
+        """
+        self._choice_sum: int | None = None
+        self._max_marks: int | None = None
+        self._min_marks: int | None = None
+        self._min_known = False
+
+    def set_choice(self, band_name: str, choice: int) -> None:
+        """
+        Sets a band's choice, keeping the running sum of choices up to date.
+        """
+        band = self.bands[band_name]
+        if self._choice_sum is not None:
+            self._choice_sum += choice - band.choice
+        band.choice = choice
 
     def calc_marks(self) -> float:
-        sum = 0.0
-        for b in self.bands.values():
-            sum += b.calc_marks()
-        return sum / float(len(self.bands))
+        if self._choice_sum is None:
+            self._choice_sum = sum(b.choice for b in self.bands.values())
+        return self._choice_sum / float(len(self.bands))
 
     def max_marks(self) -> int:
-        marks = 0
-        for b in self.bands.values():
-            marks = max(marks, b.max_marks())
-        return marks
+        if self._max_marks is None:
+            marks = 0
+            for b in self.bands.values():
+                marks = max(marks, b.max_marks())
+            self._max_marks = marks
+        return self._max_marks
 
     def min_marks(self) -> int | None:
-        marks = None
-        for b in self.bands.values():
-            if marks is None:
-                marks = b.min_marks()
-            else:
-                marks = min(marks, b.min_marks())
-        return marks
+        if not self._min_known:
+            marks = None
+            for b in self.bands.values():
+                if marks is None:
+                    marks = b.min_marks()
+                else:
+                    marks = min(marks, b.min_marks())
+            self._min_marks = marks
+            self._min_known = True
+        return self._min_marks
 
     def __eq__(self, other: object) -> bool | NotImplementedType:
         if not isinstance(other, Task):
@@ -112,6 +139,7 @@ class Task:
         for band in self.bands.values():
             self.comment = ""
             band.clear_marks()
+        self._choice_sum = 0
 
 
 @serde
@@ -125,6 +153,16 @@ class Rubric:
     def __post_init__(self):
         self._callback = None
 
+        # Running totals, kept up to date by update_mark
+        self._reset_totals()
+
+        # Cache of into_md, see _render_md
+        self._md_lock = threading.Lock()
+        self._md_lines: List[str] | None = None
+        self._md_bands: List[str] = []
+        self._md_columns: Dict[str, List[str]] = {}
+        self._md_changes: Dict[int, str] | None = None
+
     @classmethod
     def from_file(cls, path: str) -> Self:
         with open(path) as f:
@@ -141,182 +179,147 @@ class Rubric:
             f.write(self.into_md())
 
     def calc_marks(self) -> float:
-        return sum([b.calc_marks() for b in self.tasks.values()])
+        if self._total is None:
+            self._total = sum([b.calc_marks() for b in self.tasks.values()])
+        return self._total
 
     def max_marks(self) -> int:
-        return sum([b.max_marks() for b in self.tasks.values()])
-
-    def load_md(self, md: str):
-        lines = md.strip().split("\n")
-        if not lines:
+        if self._max_total is None:
+            self._max_total = sum([b.max_marks() for b in self.tasks.values()])
+        return self._max_total
+
+    def _reset_totals(self) -> None:
+        """
+        Drops every cached total, after bands or choices were changed in bulk.
+        """
+        self._total: float | None = None
+        self._max_total: int | None = None
+        for task in self.tasks.values():
+            task.reset_totals()
+
+    def load_md(self, md: str) -> List[Diagnostic]:
+        """
+        Loads the marks from a table written by into_md, see parse_marks_md.
+        Returns what couldn't be understood.
+        """
+        parsed = parse_marks_md(md, self.tasks)
+        if not parsed.found:
             self.clear_marks()
-            return  # Nothing to parse
+            return parsed.diagnostics
+
+        for (task_name, band_key), choice in parsed.choices.items():
+            task_obj = self.tasks[task_name]
+            # Ensure the band exists in this task
+            if band_key not in task_obj.bands:
+                task_obj.bands[band_key] = Band()
+            task_obj.bands[band_key].choice = choice
+        for task_name, comment in parsed.comments.items():
+            self.tasks[task_name].comment = comment
+        self._reset_totals()
+        self._invalidate_md()
+        return parsed.diagnostics
 
-        # 1) Find the header line that starts with '| cid'
-        header_idx = None
-        for i, line in enumerate(lines):
-            if line.strip().lower().startswith("| cid"):
-                header_idx = i
-                break
+    def into_md(self) -> str:
+        """
+        Renders the marks as a markdown table: a row per band key, then the
+        average and comment of each task. The table is cached and only the
+        cells of a task changed through update_mark/update_comment are
+        rendered again.
+        """
+        with self._md_lock:
+            if self._md_lines is None:
+                self._render_md()
+            return "".join(self._md_lines)
+
+    def take_md_changes(self) -> List[Tuple[int, str]] | None:
+        """
+        Returns the (line number, new line) pairs of into_md that changed
+        since the last call, or None if the whole table has to be redrawn.
+        """
+        with self._md_lock:
+            if self._md_lines is None:
+                self._render_md()
+            changes = self._md_changes
+            self._md_changes = {}
+        return None if changes is None else sorted(changes.items())
+
+    def _task_cells(self, task: Task) -> List[str]:
+        """
+        One task's column: its choice in each band (or '-'), average, comment.
+        """
+        cells = []
+        for bkey in self._md_bands:
+            band = task.bands.get(bkey)
+            cells.append(str(band.choice) if band is not None else "-")
+
+        chosen_values = [band.choice for band in task.bands.values()]
+        if chosen_values:
+            # Format to one decimal place
+            cells.append(str(round(sum(chosen_values) / len(chosen_values), 1)))
+        else:
+            cells.append("-")
 
-        if header_idx is None:
-            # No recognizable header found, nothing to load
-            self.clear_marks()
-            return
+        cells.append(task.comment)
+        return cells
 
-        # 2) Parse the header line to get the column names
-        header_line = lines[header_idx].strip()
-        header_cells = [c.strip() for c in header_line.split("|") if c.strip()]
-        # Example: header_cells might look like ['cid', 'dt1', 'dt2', 'mylib']
+    def _md_row(self, row: int) -> str:
+        # Rows are the band keys, then 'avg.' and 'comments'
+        labels = [f"{bkey}." for bkey in self._md_bands] + ["avg.", "comments"]
+        cells = [labels[row]] + [column[row] for column in self._md_columns.values()]
+        return "| " + " | ".join(cells) + " |\n"
 
-        # The first cell should be 'cid', and the rest are the task descriptions
-        if not header_cells or header_cells[0].lower() != "cid":
-            self.clear_marks()
+    def _render_md(self) -> None:
+        self._md_changes = None
+        # If there are no tasks, the table is empty
+        if not self.tasks:
+            self._md_lines = []
             return
-        task_names = header_cells[1:]  # everything after 'cid'
-
-        # 3) Create a map from task name -> Task object (for quick lookup)
-        task_map = {}
-        for k, t in self.tasks.items():
-            task_map[k] = t
-
-        # 4) Skip the alignment line (the next line after the header)
-        data_start_idx = header_idx + 2
-
-        # 5) Process the data rows
-        for row_idx in range(data_start_idx, len(lines)):
-            line = lines[row_idx].strip()
-            if not line.startswith("|"):
-                # No longer in table rows
-                break
-
-            # Split by '|' and strip
-            print("ROW CELLS HERE NERD:")
-            print(line)
-            row_cells = [c.strip() for c in line.split("|")]
-            print(row_cells)
-            row_cells = row_cells[1 : (len(row_cells) - 1)]
-            print(row_cells)
-
-            # If there are not enough cells, skip
-            if len(row_cells) < 2:
-                continue
-
-            # The first cell is either 'avg.' or something like 'a.', 'b.', etc.
-            cid_cell = row_cells[0].lower()
-            if cid_cell.startswith("avg"):
-                # This is the 'avg.' row. We ignore it.
-                continue
-
-            # The first cell may also be comment
-            comment_cell = row_cells[0].lower()
-
-            # Otherwise, parse out the band key. Usually it's 'a.', 'b.', etc.
-            band_key = cid_cell.rstrip(".")
-
-            # We expect the subsequent cells to match up with the task_names
-            # e.g. row_cells[1] => task_names[0], row_cells[2] => task_names[1], ...
-            for col_idx, cell_val in enumerate(row_cells[1:]):
-                if col_idx >= len(task_names):
-                    break  # More columns than we have tasks, oops
-
-                task_name = task_names[col_idx]
-                # Find the corresponding Task object
-                task_obj = task_map.get(task_name)
-                if not task_obj:
-                    # The Markdown had a column for a task name we don't have;
-                    # skip it or optionally create it. We'll skip here.
-                    continue
-
-                if comment_cell.startswith("comment"):
-                    print(task_names)
-                    print(task_obj)
-                    print(cell_val)
-                    task_obj.comment = cell_val
-                    continue
-
-                # If the cell is '-', skip updating
-                if cell_val == "-":
-                    continue
-
-                # Attempt to parse the cell as a float
-                try:
-                    chosen_val = int(cell_val)
-                except ValueError:
-                    # If it fails, skip (or default to 0)
-                    continue
-
-                # Ensure the band exists in this task
-                if band_key not in task_obj.bands:
-                    task_obj.bands[band_key] = Band()
-
-                # Update the chosen mark
-                task_obj.bands[band_key].choice = chosen_val
 
-    def into_md(self) -> str:
-        # 1) Collect all task names in order
-        task_names = [task for task in self.tasks.keys()]
-
-        # 2) Collect all band keys from all tasks
         all_bands = set()
         for task in self.tasks.values():
-            for band_key in task.bands.keys():
-                all_bands.add(band_key)
-        sorted_bands = sorted(all_bands)
-
-        # If there are no tasks, return an empty string
-        if not self.tasks:
-            return ""
+            all_bands.update(task.bands.keys())
+        self._md_bands = sorted(all_bands)
+        self._md_columns = {
+            name: self._task_cells(task) for name, task in self.tasks.items()
+        }
 
-        # 3) Build the header row
-        header_cells = ["cid"] + task_names
+        header_cells = ["cid"] + list(self.tasks.keys())
         header_row = "| " + " | ".join(header_cells) + " |\n"
-
-        # 4) Build the alignment row (Markdown alignment syntax)
+        # Markdown alignment row
         align_row = "| " + " | ".join(["--"] * len(header_cells)) + " |\n"
-
-        # 5) Build the rows for each band key
-        data_rows = []
-        for bkey in sorted_bands:
-            row_cells = [f"{bkey}."]  # The first cell is something like 'a.', 'b.' etc.
-            # For each task, show the chosen value if present, else '-'
-            for t in self.tasks.values():
-                band = t.bands.get(bkey)
-                if band is not None:
-                    row_cells.append(str(band.choice))
-                else:
-                    row_cells.append("-")
-            data_rows.append("| " + " | ".join(row_cells) + " |\n")
-
-        # 6) Build the average row
-        avg_cells = ["avg."]
-        for t in self.tasks.values():
-            # collect all chosen values from the bands
-            chosen_values = [band.choice for band in t.bands.values()]
-            if chosen_values:
-                avg_val = sum(chosen_values) / len(chosen_values)
-                # Format to one decimal place (you can adjust as you wish)
-                avg_cells.append(str(round(avg_val, 1)))
-            else:
-                avg_cells.append("-")
-        avg_row = "| " + " | ".join(avg_cells) + " |\n"
-
-        # 7) Build the comments row
-        comment_cells = ["comments"]
-        for t in self.tasks.values():
-            comment = t.comment
-            comment_cells.append(comment)
-        comment_row = "| " + " | ".join(comment_cells) + " |\n"
-
-        # 8) Combine everything into a single string
-        table_md = header_row + align_row + "".join(data_rows) + avg_row + comment_row
-        return table_md
+        self._md_lines = [header_row, align_row] + [
+            self._md_row(row) for row in range(len(self._md_bands) + 2)
+        ]
+
+    def _update_md(self, task_name: str, band_name: str | None) -> None:
+        """
+        Re-renders one task's column after a change to it. band_name is the
+        band whose choice changed, or None if only the comment did.
+        """
+        with self._md_lock:
+            if self._md_lines is None:
+                return  # Rendered in full on next use anyway
+            if band_name is not None and band_name not in self._md_bands:
+                self._md_lines = None
+                return
+
+            old = self._md_columns[task_name]
+            new = self._task_cells(self.tasks[task_name])
+            self._md_columns[task_name] = new
+            for row, (old_cell, new_cell) in enumerate(zip(old, new)):
+                if old_cell != new_cell:
+                    line = self._md_row(row)
+                    self._md_lines[row + 2] = line
+                    if self._md_changes is not None:
+                        self._md_changes[row + 2] = line
 
     def load_yaml(self, yaml: str):
         self.tasks = {}
         rubric = from_yaml(Rubric, yaml)
         self.yaml = yaml
         self.tasks = rubric.tasks
+        self._reset_totals()
+        self._invalidate_md()
 
     def into_yaml(self):
         return to_yaml(self)
@@ -342,18 +345,36 @@ class Rubric:
         return self.yaml == rubric2.yaml and self == rubric2
 
     def update_mark(self, task_name: str, band_name: str, chosen_mark: int) -> None:
-        self.tasks[task_name].bands[band_name].choice = chosen_mark
+        task = self.tasks[task_name]
+        if self._total is not None:
+            self._total -= task.calc_marks()
+            task.set_choice(band_name, chosen_mark)
+            self._total += task.calc_marks()
+        else:
+            task.set_choice(band_name, chosen_mark)
+        self._update_md(task_name, band_name)
         print(f"update_mark({task_name}, {band_name}, {chosen_mark})")
         self._notify_changed()
 
     def update_comment(self, task_name: str, comment: str) -> None:
         self.tasks[task_name].comment = comment
+        self._update_md(task_name, None)
         print(f"update_comment({task_name}, {comment})")
         self._notify_changed()
 
     def clear_marks(self) -> None:
         for task in self.tasks.values():
             task.clear_marks()
+        self._total = None
+        self._invalidate_md()
+
+    def _invalidate_md(self) -> None:
+        """
+        Drops the cached markdown after a change that bypassed update_mark
+        and update_comment.
+        """
+        with self._md_lock:
+            self._md_lines = None
 
     def on_change(self, callback):
         self._callback = callback
@@ -364,6 +385,152 @@ class Rubric:
             self._callback()
 
 
+@dataclass
+class Marks:
+    """
+    One student's marks against a RubricTemplate: the chosen mark of every
+    band, flattened in the template's band order, and a comment per task.
+    """
+
+    choices: List[int]
+    comments: List[str]
+
+    def copy(self) -> "Marks":
+        return Marks(list(self.choices), list(self.comments))
+
+
+@dataclass(frozen=True)
+class RubricTemplate:
+    """
+    The layout of a parsed rubric, compiled once and never modified.
+
+    Each student gets their own Rubric from instantiate(), which shares the
+    (read only) descriptions and headings with the template but has fresh
+    Task and Band objects, so marks and change callbacks can't leak from
+    one student to the next and switching doesn't re-parse any YAML.
+    """
+
+    year: str
+    sem: str
+    name: str
+    yaml: str
+    task_names: Tuple[str, ...]
+    # (task name, band name) of every band, in task then band order
+    slots: Tuple[Tuple[str, str], ...]
+    slot_index: Dict[Tuple[str, str], int]
+    descriptions: Dict[str, str]
+    headings: Dict[str, Dict[int, str]]
+    band_descriptions: Tuple[Dict[int, str], ...]
+    task_max: Dict[str, int]
+    task_min: Dict[str, int | None]
+    max_marks: int
+
+    @classmethod
+    def compile(cls, rubric: "Rubric") -> "RubricTemplate":
+        slots = tuple(
+            (task_name, band_name)
+            for task_name, task in rubric.tasks.items()
+            for band_name in task.bands
+        )
+        task_max = {name: task.max_marks() for name, task in rubric.tasks.items()}
+        return cls(
+            year=rubric.year,
+            sem=rubric.sem,
+            name=rubric.name,
+            yaml=rubric.yaml,
+            task_names=tuple(rubric.tasks),
+            slots=slots,
+            slot_index={slot: i for i, slot in enumerate(slots)},
+            descriptions={
+                name: task.description for name, task in rubric.tasks.items()
+            },
+            headings={name: task.headings for name, task in rubric.tasks.items()},
+            band_descriptions=tuple(
+                rubric.tasks[task].bands[band].descriptions for task, band in slots
+            ),
+            task_max=task_max,
+            task_min={name: task.min_marks() for name, task in rubric.tasks.items()},
+            max_marks=sum(task_max.values()),
+        )
+
+    @classmethod
+    def from_yaml(cls, yaml: str) -> "RubricTemplate":
+        return cls.compile(Rubric.from_yaml(yaml))
+
+    @classmethod
+    def from_file(cls, path: str) -> "RubricTemplate":
+        return cls.compile(Rubric.from_file(path))
+
+    def new_marks(self) -> Marks:
+        return Marks([0] * len(self.slots), [""] * len(self.task_names))
+
+    def instantiate(self, marks: Marks | None = None) -> "Rubric":
+        """
+        Returns a new Rubric with this layout, holding the given marks
+        (or none). The marks are copied, not referenced.
+        """
+        marks = marks or self.new_marks()
+        tasks: Dict[str, Task] = {}
+        for i, name in enumerate(self.task_names):
+            tasks[name] = Task(
+                description=self.descriptions[name],
+                comment=marks.comments[i],
+                headings=self.headings[name],
+                bands={},
+            )
+        for i, (task, band) in enumerate(self.slots):
+            tasks[task].bands[band] = Band(
+                descriptions=self.band_descriptions[i], choice=marks.choices[i]
+            )
+        return Rubric(
+            year=self.year, sem=self.sem, name=self.name, yaml=self.yaml, tasks=tasks
+        )
+
+    def parse_md(self, md: str) -> Tuple[Marks, List[Diagnostic]]:
+        """
+        Parses a marks table straight into Marks, without building a Rubric.
+        Marks for bands the template doesn't have are reported and dropped.
+        """
+        parsed = parse_marks_md(md, self.task_names)
+        marks = self.new_marks()
+        diagnostics = parsed.diagnostics
+        for slot, choice in parsed.choices.items():
+            index = self.slot_index.get(slot)
+            if index is None:
+                diagnostics.append(Diagnostic(0, f"unknown band {slot[1]}", slot[0]))
+            else:
+                marks.choices[index] = choice
+        for i, name in enumerate(self.task_names):
+            marks.comments[i] = parsed.comments.get(name, "")
+        return marks, diagnostics
+
+    def marks_of(self, rubric: "Rubric") -> Marks:
+        """
+        Extracts the marks from a Rubric instantiated from this template.
+        """
+        return Marks(
+            [rubric.tasks[task].bands[band].choice for task, band in self.slots],
+            [rubric.tasks[name].comment for name in self.task_names],
+        )
+
+    def apply(self, rubric: "Rubric", marks: Marks) -> int:
+        """
+        Updates a Rubric instantiated from this template to hold marks, through
+        update_mark/update_comment so only what differs is changed.
+        Returns the number of bands and comments changed.
+        """
+        changed = 0
+        for (task, band), choice in zip(self.slots, marks.choices):
+            if rubric.tasks[task].bands[band].choice != choice:
+                rubric.update_mark(task, band, choice)
+                changed += 1
+        for task, comment in zip(self.task_names, marks.comments):
+            if rubric.tasks[task].comment != comment:
+                rubric.update_comment(task, comment)
+                changed += 1
+        return changed
+
+
 if __name__ == "__main__":
     rubric = Rubric(
         year="2024",
@@ -401,9 +568,9 @@ if __name__ == "__main__":
     md = rubric.into_md()
     print(md)
 
-    rubric.tasks["dt1"].bands["a"].choice = 4
-    rubric.tasks["dt2"].bands["b"].choice = 4
-    rubric.tasks["dt2"].comment = "yeet"
+    rubric.update_mark("dt1", "a", 4)
+    rubric.update_mark("dt2", "b", 4)
+    rubric.update_comment("dt2", "yeet")
 
     print(rubric.into_md())
 
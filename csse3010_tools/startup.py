@@ -0,0 +1,61 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+
+class StartupProfile:
+    """
+    Times the phases of starting the app (imports, token load, roster,
+    criteria, first paint...) for --profile-startup. Phases can overlap and
+    run on any thread, each is reported with when it started and how long
+    it took, relative to when this module was imported.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._begun: Dict[str, float] = {}
+        # (name, start, end), in the order they finished
+        self._phases: List[Tuple[str, float, float]] = []
+
+    def begin(self, name: str) -> None:
+        with self._lock:
+            self._begun[name] = time.perf_counter()
+
+    def end(self, name: str) -> None:
+        """
+        Ends a phase started with begin(). Phases never begun start with
+        the profile, like the imports do.
+        """
+        now = time.perf_counter()
+        with self._lock:
+            start = self._begun.pop(name, self._start)
+            self._phases.append((name, start, now))
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end(name)
+
+    def report(self) -> str:
+        with self._lock:
+            phases = sorted(self._phases, key=lambda phase: phase[1])
+        lines = [f"{'phase':<14}{'at':>9}{'took':>9}"]
+        for name, start, end in phases:
+            lines.append(
+                f"{name:<14}{(start - self._start) * 1000:>7.0f}ms"
+                f"{(end - start) * 1000:>7.0f}ms"
+            )
+        if phases:
+            total = max(end for _, _, end in phases) - self._start
+            lines.append(f"{'total':<14}{total * 1000:>7.0f}ms")
+        return "\n".join(lines)
+
+
+# Imported first by main, so it is created as close to startup as we can get.
+STARTUP = StartupProfile()
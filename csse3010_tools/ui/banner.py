@@ -5,10 +5,15 @@ from textual.app import ComposeResult
 
 
 class Banner(Horizontal):
-    """Displays some info from Gitea (like version & user)."""
+    """
+    Displays some info from Gitea (like version & user), loading progress
+    and the state of the marks repo.
+    """
 
     version = reactive("gitea version")
     user = reactive("gitea user")
+    progress = reactive("Loading...")
+    sync_status = reactive("")
 
     def watch_version(self, old_version: str, new_version: str) -> None:
         self.query_one("#gitea_version", Label).update(str(new_version))
@@ -16,6 +21,14 @@ class Banner(Horizontal):
     def watch_user(self, old_user: str, new_user: str) -> None:
         self.query_one("#gitea_user", Label).update(str(new_user))
 
+    def watch_progress(self, old_progress: str, new_progress: str) -> None:
+        self.query_one("#warm_up_progress", Label).update(str(new_progress))
+
+    def watch_sync_status(self, old_status: str, new_status: str) -> None:
+        self.query_one("#marks_sync_status", Label).update(str(new_status))
+
     def compose(self) -> ComposeResult:
         yield Label("GITEA VERSION", id="gitea_version")
         yield Label("GITEA USER", id="gitea_user")
+        yield Label("Loading...", id="warm_up_progress")
+        yield Label("", id="marks_sync_status")
@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+from typing import BinaryIO, List, Optional
+
+from textual.widgets import Log
+
+# Lines kept on screen, older ones are dropped. The full output is on disk.
+BUILD_LOG_MAX_LINES = 5000
+
+# How often buffered output is pushed to the screen.
+BUILD_LOG_FRAME_RATE = 15
+
+# How much is read from a build's stdout at a time.
+BUILD_LOG_CHUNK_SIZE = 64 * 1024
+
+BUILD_LOG_ROOT = os.path.join("temporary", "logs")
+
+
+class BuildLog(Log):
+    """
+    A Log for build output that can be fed from any thread.
+
+    Output is buffered and written to the screen in batches a few times a
+    second rather than line by line, so a build spewing thousands of
+    warnings doesn't flood the event loop. Only the last
+    BUILD_LOG_MAX_LINES lines are kept on screen; the whole output can be
+    captured to a file with start_capture.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("max_lines", BUILD_LOG_MAX_LINES)
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        # Output not on screen yet, None where a stream of output ended
+        self._pending: List[Optional[bytes]] = []
+        self._partial = b""
+        self._capture: Optional[BinaryIO] = None
+
+    def on_mount(self) -> None:
+        self.set_interval(1 / BUILD_LOG_FRAME_RATE, self._flush)
+
+    def feed(self, data: bytes) -> None:
+        """Queues raw output to be shown, safe to call from any thread."""
+        with self._lock:
+            self._pending.append(data)
+            if self._capture:
+                self._capture.write(data)
+
+    def end_output(self) -> None:
+        """
+        Marks the end of a stream of output (a build, a replayed log), so a
+        last line without a newline is shown rather than held back.
+        """
+        with self._lock:
+            self._pending.append(None)
+
+    def feed_line(self, line: str) -> None:
+        """Queues a line of our own (not build output) to be shown."""
+        self.feed(f"{line}\n".encode("utf8"))
+
+    def pump(self, stream: BinaryIO) -> None:
+        """
+        Feeds everything from stream until EOF, reading in large chunks.
+        Blocks, so call it from a worker thread.
+        """
+        fd = stream.fileno()
+        try:
+            while chunk := os.read(fd, BUILD_LOG_CHUNK_SIZE):
+                self.feed(chunk)
+        finally:
+            self.end_output()
+
+    def replay(self, path: str) -> None:
+        """Feeds a previously saved log file."""
+        try:
+            with open(path, "rb") as f:
+                while chunk := f.read(BUILD_LOG_CHUNK_SIZE):
+                    self.feed(chunk)
+        finally:
+            self.end_output()
+
+    def start_capture(self, name: str) -> str:
+        """
+        Starts saving everything fed to the log into a new file under
+        temporary/logs, and returns its path.
+        """
+        os.makedirs(BUILD_LOG_ROOT, exist_ok=True)
+        path = os.path.join(
+            BUILD_LOG_ROOT, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}.log"
+        )
+        with self._lock:
+            if self._capture:
+                self._capture.close()
+            self._capture = open(path, "wb")
+        return path
+
+    def stop_capture(self) -> None:
+        with self._lock:
+            if self._capture:
+                self._capture.close()
+                self._capture = None
+
+    def clear(self) -> "BuildLog":
+        """Clears the screen, along with any output not shown yet."""
+        with self._lock:
+            self._pending.clear()
+        self._partial = b""
+        return super().clear()
+
+    def _flush(self) -> None:
+        """
+        Writes the complete lines buffered since the last frame, and the
+        last line of any output that has ended.
+        """
+        with self._lock:
+            if not self._pending:
+                return
+            pending = self._pending
+            self._pending = []
+        lines = []
+        data = self._partial
+        for chunk in pending:
+            if chunk is not None:
+                data += chunk
+                continue
+            if data:
+                lines += data.split(b"\n")
+                if not lines[-1]:
+                    lines.pop()
+                data = b""
+        lines += data.split(b"\n")
+        self._partial = lines.pop()
+        # Anything beyond max_lines would be dropped straight away anyway
+        lines = lines[-(self.max_lines or len(lines)) :]
+        self.write_lines(line.decode("utf8", errors="replace") for line in lines)
+
+    def on_unmount(self) -> None:
+        self.stop_capture()
@@ -1,25 +1,35 @@
 from textual.containers import Container, Horizontal
-from textual.widgets import Button, Log
+from textual.widgets import Button, Label
 from textual.messages import Message
 from dataclasses import dataclass
 
+from csse3010_tools.ui.build_log import BuildLog
+
 
 @dataclass
 class BuildCommand(Message):
     type: str
 
+
 class BuildMenu(Container):
     def compose(self):
         with Horizontal(id="buildbar"):
             yield Button("Build", id="buildbutton", classes="metadata_field")
+            yield Button("Rebuild", id="rebuildbutton", classes="metadata_field")
             yield Button("flash", id="flashbutton", classes="metadata_field")
             yield Button("Clean", id="cleanbutton", classes="metadata_field")
-        yield Log(id="buildlog")
+            yield Button("Build all", id="buildallbutton", classes="metadata_field")
+            yield Label("Not pre-built", id="prebuild_status")
+        yield BuildLog(id="buildlog")
 
     def on_button_pressed(self, event: Button.Pressed) -> None:
         if event.button.id == "buildbutton":
             self.post_message(BuildCommand("build"))
+        if event.button.id == "rebuildbutton":
+            self.post_message(BuildCommand("rebuild"))
         if event.button.id == "flashbutton":
             self.post_message(BuildCommand("flash"))
         if event.button.id == "cleanbutton":
             self.post_message(BuildCommand("clean"))
+        if event.button.id == "buildallbutton":
+            self.post_message(BuildCommand("buildall"))
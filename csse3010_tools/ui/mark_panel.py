@@ -1,4 +1,4 @@
-from typing import Optional, List
+from typing import TYPE_CHECKING, Dict, Optional, List, Tuple
 from dataclasses import dataclass
 
 from textual import on
@@ -15,7 +15,8 @@ from textual.widgets import (
     Label,
 )
 
-from csse3010_tools.rubric import Task, Rubric
+if TYPE_CHECKING:
+    from csse3010_tools.rubric import Task, Rubric
 
 
 class MarkSelected(Message):
@@ -66,22 +67,31 @@ class CommentInput(Input):
 
 
 class TaskPanel(Container):
-    def __init__(self, rubric: Rubric, task_name: str, *args, **kwargs):
+    def __init__(self, rubric: "Rubric", task_name: str, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.rubric = rubric
         self.task_name = task_name
-        self.task_obj: Task = self.rubric.tasks[self.task_name]
+        self.task_obj: "Task" = self.rubric.tasks[self.task_name]
+
+        # (band, mark) -> its button, and the selected button of each band,
+        # so a click only has to touch the old and new selection
+        self._buttons: Dict[Tuple[str, int], MarkButton] = {}
+        self._selected: Dict[str, MarkButton] = {}
+        self._collapsible = Collapsible(title=f"Task")
 
     def compose(self) -> ComposeResult:
         # Build a collapsible
-        with Collapsible(title=f"Task"):
+        with self._collapsible:
             # Description
             if self.task_obj.description:
                 yield (Static(f"{self.task_obj.description}"))
 
+            max_marks = self.task_obj.max_marks()
+            min_marks = self.task_obj.min_marks() or 0
+
             band_grid = Grid(classes="band")
             with band_grid:
-                cols = self.task_obj.max_marks() + 1 - (self.task_obj.min_marks() or 0)
+                cols = max_marks + 1 - min_marks
                 band_grid.styles.grid_size_columns = cols + 1
                 grid_columns = "4" + " 1fr" * (cols)
                 grid_rows = "1" + " auto" * (len(self.task_obj.bands))
@@ -95,17 +105,17 @@ class TaskPanel(Container):
                 for marks, name in headings.items():
                     yield (Static(f"{name} ({marks})"))
 
+                # Headings that have a button in every band
+                marks_in_range = [
+                    mark for mark in headings if min_marks <= mark <= max_marks
+                ]
+
                 # Sub-bands
                 for key, band in self.task_obj.bands.items():
                     yield (Static(f"{key}", classes="subband_label"))
 
                     # Create a MarkButton for each heading item
-                    for mark, _ in [
-                        item
-                        for item in headings.items()
-                        if self.task_obj.max_marks() >= item[0]
-                        and (self.task_obj.min_marks() or 0) <= item[0]
-                    ]:
+                    for mark in marks_in_range:
                         btn = MarkButton(
                             label=band.descriptions[mark],
                             task_name=self.task_name,
@@ -113,8 +123,10 @@ class TaskPanel(Container):
                             chosen_mark=mark,
                             classes="marktile",
                         )
-                        if self.rubric.tasks[self.task_name].bands[key].choice == mark:
+                        self._buttons[(key, mark)] = btn
+                        if band.choice == mark:
                             btn.add_class("selected_markbutton")
+                            self._selected[key] = btn
                         yield (btn)
             # Comments
             yield CommentInput(
@@ -134,34 +146,78 @@ class TaskPanel(Container):
     def on_mount(self):
         self.refresh_calculation()
 
+    def bind(self, rubric: "Rubric") -> None:
+        """
+        Shows another rubric with the same layout in place, by moving the
+        selected buttons and replacing the comment.
+        """
+        self.rubric = rubric
+        self.task_obj = rubric.tasks[self.task_name]
+        for key, band in self.task_obj.bands.items():
+            self._select(key, band.choice)
+        comment_input = self.query_one(CommentInput)
+        # Not a change by the user, so don't write it back to the rubric
+        with comment_input.prevent(Input.Changed):
+            comment_input.value = self.task_obj.comment
+        self.refresh_calculation()
+
     def on_mark_selected(self, message: MarkSelected) -> None:
         """When a MarkButton is clicked, highlight it and unhighlight others in the same sub-band."""
         if message.task_name != self.task_name:
             return  # Not for us; ignore.
+        self._select(message.band_name, message.chosen_mark)
 
-        # Unhighlight any MarkButton in the same subband
-        for btn in self.query(MarkButton):
-            if btn.band_name == message.band_name:
-                btn.remove_class("selected_markbutton")
-
-        # Highlight the clicked one
-        for btn in self.query(MarkButton):
-            if (
-                btn.band_name == message.band_name
-                and btn.chosen_mark == message.chosen_mark
-            ):
-                btn.add_class("selected_markbutton")
+    def _select(self, band_name: str, mark: int) -> None:
+        """Moves the band's highlight to the button for mark, if there is one."""
+        btn = self._buttons.get((band_name, mark))
+        old = self._selected.get(band_name)
+        if old is btn:
+            return
+        if old is not None:
+            old.remove_class("selected_markbutton")
+            del self._selected[band_name]
+        if btn is not None:
+            btn.add_class("selected_markbutton")
+            self._selected[band_name] = btn
 
     def refresh_calculation(self) -> None:
         """Refresh the label that shows the total mark for this task."""
-        collapsible = self.query_one("Collapsible", Collapsible)
-        collapsible.title = f"({self.task_obj.calc_marks()}/{self.task_obj.max_marks()}) Task: {self.task_name}"
+        self._collapsible.title = f"({self.task_obj.calc_marks()}/{self.task_obj.max_marks()}) Task: {self.task_name}"
+
+
+def rubric_layout(rubric: Optional["Rubric"]) -> tuple:
+    """
+    What decides the widgets of a MarkPanel: rubrics with the same layout
+    differ only in their marks and comments.
+    """
+    if not rubric:
+        return ()
+    return (rubric.yaml,) + tuple(
+        (name, tuple(task.bands), tuple(task.headings))
+        for name, task in rubric.tasks.items()
+    )
 
 
 class MarkPanel(VerticalScroll):
     def __init__(self, rubric, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.rubric = rubric
+        self._rubric_layout = rubric_layout(rubric)
+        self._task_panels: Dict[str, TaskPanel] = {}
+
+    def bind(self, rubric: "Rubric") -> bool:
+        """
+        Switches the panel to another rubric with the same layout (e.g. the
+        next student's) without rebuilding it. Returns False, leaving the
+        panel alone, if the layout differs.
+        """
+        if not rubric or rubric_layout(rubric) != self._rubric_layout:
+            return False
+        self.rubric = rubric
+        for panel in self._task_panels.values():
+            panel.bind(rubric)
+        self.update_border()
+        return True
 
     def compose(self) -> ComposeResult:
         """
@@ -175,7 +231,9 @@ class MarkPanel(VerticalScroll):
 
         self.update_border()
         for task_name in self.rubric.tasks:
-            yield TaskPanel(self.rubric, task_name)
+            panel = TaskPanel(self.rubric, task_name)
+            self._task_panels[task_name] = panel
+            yield panel
 
     def update_border(self) -> None:
         """
@@ -206,6 +264,6 @@ class MarkPanel(VerticalScroll):
         self.update_border()
 
         # Update the display for the relevant task
-        for panel in self.query(TaskPanel):
-            if panel.task_name == event.task_name:
-                panel.refresh_calculation()
+        panel = self._task_panels.get(event.task_name)
+        if panel:
+            panel.refresh_calculation()
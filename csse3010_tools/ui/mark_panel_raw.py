@@ -1,5 +1,28 @@
+from typing import TYPE_CHECKING, Optional
+
 from textual.widgets import TextArea
 
+if TYPE_CHECKING:
+    from csse3010_tools.rubric import Rubric
+
 
 class MarkPanelRaw(TextArea):
-    pass
+    _shown: Optional["Rubric"] = None
+
+    def show(self, rubric: "Rubric") -> None:
+        """
+        Shows the rubric's markdown. If it was already showing, only the
+        lines that changed since are replaced.
+        """
+        changes = rubric.take_md_changes()
+        if changes is None or rubric is not self._shown:
+            self._shown = rubric
+            self.load_text(rubric.into_md())
+            return
+
+        for row, line in changes:
+            if row >= self.document.line_count:
+                self.load_text(rubric.into_md())
+                return
+            old = self.document.get_line(row)
+            self.replace(line.rstrip("\n"), (row, 0), (row, len(old)))